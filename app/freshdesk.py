@@ -1,29 +1,86 @@
+import asyncio
 import httpx
+import logging
+import orjson
 import os
 import base64
 import re
-from typing import Dict, Any, List
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple
+from cachetools import TTLCache
+from selectolax.lexbor import LexborHTMLParser
 from dotenv import load_dotenv
+from .singleflight import single_flight
 
 # Look for .env in current dir and /app subdir
 load_dotenv()
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+logger = logging.getLogger("app.freshdesk")
+
 FRESH_DOMAIN = os.getenv('FRESH_DOMAIN')
 FRESH_API_KEY = os.getenv('FRESH_API_KEY')
 FRESH_BASE = f"https://{FRESH_DOMAIN}/api/v2" if FRESH_DOMAIN else ""
 
 # Safety: Don't crash at import time if API KEY is missing
-FRESH_HEADERS = {}
-if FRESH_API_KEY:
-    auth_str = f"{FRESH_API_KEY}:X"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-    FRESH_HEADERS = {
-        "Authorization": f"Basic {encoded_auth}",
-        "Content-Type": "application/json"
-    }
-else:
-    print(" [WARNING] FRESH_API_KEY not found in environment. Freshdesk integration will fail.", flush=True)
+# Encoded once and handed to the shared client, which sends it on every request
+_AUTH_TOKEN = base64.b64encode(f"{FRESH_API_KEY}:X".encode()).decode() if FRESH_API_KEY else None
+FRESH_HEADERS = MappingProxyType({
+    "Authorization": f"Basic {_AUTH_TOKEN}",
+    "Content-Type": "application/json"
+} if _AUTH_TOKEN else {})
+if not _AUTH_TOKEN:
+    logger.warning("FRESH_API_KEY not found in environment. Freshdesk integration will fail.")
+
+# Precompiled patterns used on every request
+_NON_DIGIT = re.compile(r'\D')
+_NON_WORD = re.compile(r'[^\w\s]')
+_ACTION_TAG = re.compile(r'\[ACTION:[^\]]+\]')
+
+# Search API queries; Freshdesk requires the query itself to be wrapped in double quotes
+_CONTACT_QUERY_NARROW = "\"phone:'{ten}' OR mobile:'{ten}'\""
+_CONTACT_QUERY_WIDE = "\"(phone:'{ten}' OR mobile:'{ten}' OR phone:'{full}' OR mobile:'{full}' OR phone:'+{full}')\""
+
+# Static ticket-note transcript wrapper
+_NOTE_HEADER = "<h3>Call Transcript (Arta AI)</h3><div style='font-family: sans-serif; line-height: 1.6;'>"
+_NOTE_FOOTER = "</div><hr><p><small><i>Generated by Sandeza Support AI</i></small></p>"
+
+# KB search results keyed by normalized search term (15 min TTL)
+_KB_CACHE: TTLCache = TTLCache(maxsize=512, ttl=900)
+
+# Contacts found by phone, keyed by ten-digit and full number (5 min TTL)
+_CONTACT_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=300)
+
+# Per-endpoint request timeouts (seconds); KB search stays tight for voice latency
+HTTP_TIMEOUTS = {
+    "default": httpx.Timeout(8.0, connect=2.0),
+    "kb": 1.5,
+    "tickets": 10,
+    "notes": 10,
+}
+
+# Shared pooled client: keeps TCP/TLS connections to Freshdesk warm across calls
+_client: Optional[httpx.AsyncClient] = None
+
+async def get_client() -> httpx.AsyncClient:
+    """Return the shared Freshdesk client, creating it lazily on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=FRESH_BASE,
+            headers=FRESH_HEADERS,
+            http2=True,  # multiplex concurrent Freshdesk calls over one connection
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=HTTP_TIMEOUTS["default"]
+        )
+    return _client
+
+async def aclose():
+    """Close the shared Freshdesk client (called on app shutdown)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
 
 async def search_contact_by_phone(phone: str) -> Dict[str, Any]:
     """Search for a contact in Freshdesk using multiple phone number strategies."""
@@ -31,144 +88,208 @@ async def search_contact_by_phone(phone: str) -> Dict[str, Any]:
         return {}
     
     # 1. CLEAN PHONES
-    full_phone = re.sub(r'\D', '', phone)
+    full_phone = _NON_DIGIT.sub('', phone)
+    if len(full_phone) < 7:
+        # e.g. "anonymous" caller-ID: nothing searchable, skip the round trip
+        logger.info("[SEARCH] Skipping lookup for non-phone caller ID: %s", phone)
+        return {}
     ten_digit = full_phone[-10:] if len(full_phone) >= 10 else full_phone
     
-    print(f" [SEARCH] Identifying contact: {phone} (10D: {ten_digit}, Full: {full_phone})", flush=True)
+    cached = _CONTACT_CACHE.get(ten_digit)
+    if cached is not None:
+        logger.info("[SEARCH] Cache hit for %s: %s (ID: %s)", ten_digit, cached.get('name'), cached.get('id'))
+        return cached
+    
+    # Concurrent lookups for the same number share one search
+    return await single_flight(f"contact:{ten_digit}", lambda: _search_contact(phone, ten_digit, full_phone))
+
+async def _search_contact(phone: str, ten_digit: str, full_phone: str) -> Dict[str, Any]:
+    logger.info("[SEARCH] Identifying contact: %s (10D: %s, Full: %s)", phone, ten_digit, full_phone)
     
-   
-    query = f"(phone:'{ten_digit}' OR mobile:'{ten_digit}' OR phone:'{full_phone}' OR mobile:'{full_phone}' OR phone:'+{full_phone}')"
+    # Stage 1: the ten-digit form matches most real callers and is the cheapest query.
+    # Stage 2: only if that misses, fall back to every stored variant.
     # Note: Search API results can take a few minutes to index, but it's the requested robust method.
+    queries = [
+        _CONTACT_QUERY_NARROW.format(ten=ten_digit),
+        _CONTACT_QUERY_WIDE.format(ten=ten_digit, full=full_phone)
+    ]
     
     try:
-        async with httpx.AsyncClient(timeout=8) as client:
-            url = f"{FRESH_BASE}/search/contacts"
-            print(f" [SEARCH] GET {url} query={query}", flush=True)
-            
-            resp = await client.get(
-                url,
-                params={"query": f'"{query}"'},
-                headers=FRESH_HEADERS
-            )
+        client = await get_client()
+        url = "/search/contacts"
+        
+        for query in queries:
+            logger.info("[SEARCH] GET %s query=%s", url, query)
+            resp = await client.get(url, params={"query": query})
+            logger.info("[SEARCH] Status: %s", resp.status_code)
             
-            print(f" [SEARCH] Status: {resp.status_code}", flush=True)
+            if resp.status_code != 200:
+                logger.error("[SEARCH] Error: %s", resp.text[:100])
+                return {}
             
-            if resp.status_code == 200:
-                data = resp.json()
-                results = data.get("results", [])
-                if results and isinstance(results, list):
-                    contact = results[0]
-                    print(f" Found contact: {contact.get('name')} (ID: {contact.get('id')})", flush=True)
-                    return contact
-                else:
-                    print(f" [SEARCH] No contact matched", flush=True)
-            else:
-                print(f" [SEARCH] Error: {resp.text[:100]}", flush=True)
-
-            return {}
+            results = orjson.loads(resp.content).get("results", [])
+            if results and isinstance(results, list):
+                contact = results[0]
+                logger.info("Found contact: %s (ID: %s)", contact.get('name'), contact.get('id'))
+                _CONTACT_CACHE[ten_digit] = contact
+                _CONTACT_CACHE[full_phone] = contact
+                return contact
+        
+        logger.info("[SEARCH] No contact matched")
+        return {}
             
     except Exception as e:
-        print(f" Contact Search Error: {e}", flush=True)
+        logger.error("Contact Search Error: %s", e)
         return {}
 
+def _invalidate_contact(contact_id: int):
+    """Drop every cached phone entry that points at the given contact."""
+    for key in [k for k, c in _CONTACT_CACHE.items() if c.get("id") == contact_id]:
+        _CONTACT_CACHE.pop(key, None)
+
 async def update_contact_name(contact_id: int, new_name: str) -> bool:
     """Update a contact's name in Freshdesk."""
     try:
-        async with httpx.AsyncClient(timeout=8) as client:
-            url = f"{FRESH_BASE}/contacts/{contact_id}"
-            resp = await client.put(url, json={"name": new_name}, headers=FRESH_HEADERS)
-            if resp.status_code in [200, 201]:
-                print(f" Contact {contact_id} renamed to {new_name}", flush=True)
-                return True
-            else:
-                print(f" Contact rename failed: {resp.status_code} - {resp.text}", flush=True)
-                return False
+        client = await get_client()
+        resp = await client.put(f"/contacts/{contact_id}", content=orjson.dumps({"name": new_name}))
+        if resp.status_code in [200, 201]:
+            logger.info("Contact %s renamed to %s", contact_id, new_name)
+            _invalidate_contact(contact_id)
+            return True
+        else:
+            logger.warning("Contact rename failed: %s - %s", resp.status_code, resp.text)
+            return False
     except Exception as e:
-        print(f" Contact Rename Error: {e}", flush=True)
+        logger.error("Contact Rename Error: %s", e)
         return False
 
 async def create_contact(name: str, phone: str) -> Dict[str, Any]:
     """Create a new contact in Freshdesk with name and phone."""
     try:
-        async with httpx.AsyncClient(timeout=8) as client:
-            url = f"{FRESH_BASE}/contacts"
-            payload = {
-                "name": name,
-                "phone": phone
-            }
-            resp = await client.post(url, json=payload, headers=FRESH_HEADERS)
-            if resp.status_code in [200, 201]:
-                contact = resp.json()
-                print(f" [CONTACT] Created new contact: {name} (ID: {contact.get('id')})", flush=True)
-                return contact
-            else:
-                print(f" [CONTACT] Create failed: {resp.status_code} - {resp.text}", flush=True)
-                return {}
+        client = await get_client()
+        payload = {
+            "name": name,
+            "phone": phone
+        }
+        resp = await client.post("/contacts", content=orjson.dumps(payload))
+        if resp.status_code in [200, 201]:
+            contact = orjson.loads(resp.content)
+            logger.info("[CONTACT] Created new contact: %s (ID: %s)", name, contact.get('id'))
+            _CONTACT_CACHE.pop(_NON_DIGIT.sub('', phone or '')[-10:], None)
+            return contact
+        else:
+            logger.warning("[CONTACT] Create failed: %s - %s", resp.status_code, resp.text)
+            return {}
     except Exception as e:
-        print(f" [CONTACT] Create error: {e}", flush=True)
+        logger.error("[CONTACT] Create error: %s", e)
         return {}
         
 async def get_latest_tickets(contact_id: int) -> List[Dict[str, Any]]:
     """Fetch the last 2 open/pending tickets for the contact."""
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            # Use standard List Tickets API
-            url = f"{FRESH_BASE}/tickets"
-            params = {
-                "requester_id": contact_id,
-                "include": "description",
-                "order_by": "created_at",
-                "order_type": "desc"
-            }
-            
-            print(f" [TICKETS] Fetching for requester={contact_id}", flush=True)
-            resp = await client.get(url, params=params, headers=FRESH_HEADERS)
-            print(f" [TICKETS] Status: {resp.status_code}", flush=True)
-            
-            if resp.status_code == 200:
-                all_tickets = resp.json()
-                if isinstance(all_tickets, list):
-                    # Filter for Open (2) and Pending (3) in Python
-                    tickets = [t for t in all_tickets if t.get("status") in [2, 3]]
-                    print(f" Found {len(tickets)} open/pending from {len(all_tickets)} total.", flush=True)
-                    return tickets[:2]
-                else:
-                    print(f" [TICKETS] Response not a list: {type(all_tickets)}", flush=True)
+        client = await get_client()
+        # List Tickets API rather than /search/tickets: search results carry no
+        # description (the prompt uses it) and the search index lags, so a
+        # ticket created earlier in the same call would be missing
+        params = {
+            "requester_id": contact_id,
+            "include": "description",
+            "order_by": "created_at",
+            "order_type": "desc",
+            # Only the 2 newest open/pending are used; a 10-ticket page leaves
+            # room for resolved ones without pulling the default 30
+            "per_page": 10
+        }
+        
+        logger.info("[TICKETS] Fetching for requester=%s", contact_id)
+        resp = await client.get("/tickets", params=params, timeout=HTTP_TIMEOUTS["tickets"])
+        logger.info("[TICKETS] Status: %s", resp.status_code)
+        
+        if resp.status_code == 200:
+            all_tickets = orjson.loads(resp.content)
+            if isinstance(all_tickets, list):
+                tickets = [t for t in all_tickets if t.get("status") in (2, 3)]  # Open / Pending
+                logger.info("Found %s open/pending from %s total.", len(tickets), len(all_tickets))
+                return tickets[:2]
             else:
-                print(f" [TICKETS] List error: {resp.text[:100]}", flush=True)
-            
-            return []
+                logger.info("[TICKETS] Response not a list: %s", type(all_tickets))
+        else:
+            logger.error("[TICKETS] List error: %s", resp.text[:100])
+        
+        return []
     except Exception as e:
-        print(f" Ticket Fetch Error: {e}", flush=True)
+        logger.error("Ticket Fetch Error: %s", e)
         return []
 
 async def fetch_kb_context(query: str) -> str:
     if not query.strip(): return ""
     
-    words = re.sub(r'[^\w\s]', '', query.lower()).split()
+    words = _NON_WORD.sub('', query.lower()).split()
     words = [w for w in words if len(w) > 2][:6]
     search_term = ' '.join(words)
     
+    cached = _KB_CACHE.get(search_term)
+    if cached is not None:
+        return cached
+    
+    # Concurrent identical searches share one request
+    return await single_flight(f"kb:{search_term}", lambda: _fetch_kb(search_term))
+
+async def _fetch_kb(search_term: str) -> str:
     try:
-        # Strict 1.5s timeout for voice latency
-        async with httpx.AsyncClient(timeout=1.5) as client:
-            resp = await client.get(
-                f"https://{FRESH_DOMAIN}/support/search/solutions.json",
-                params={'term': search_term}
-            )
-            if resp.status_code != 200:
-                return ""
-            articles = resp.json().get('data', [])
+        client = await get_client()
+        resp = await client.get(
+            f"https://{FRESH_DOMAIN}/support/search/solutions.json",
+            params={'term': search_term},
+            timeout=HTTP_TIMEOUTS["kb"]
+        )
+        if resp.status_code != 200:
+            return ""
+        articles = orjson.loads(resp.content).get('data', [])
         
-        snippets = []
-        for article in articles[:3]:
-            title = re.sub(r'<[^>]*>', '', article.get('title', '')).strip()
-            desc = re.sub(r'<[^>]*>', ' ', article.get('desc', '')).strip()
-            snippets.append(f"• {title}: {desc[:120]}")
-        return "\n".join(snippets)
-    except:
+        result = "\n".join(
+            f"• {LexborHTMLParser(article.get('title', '')).text(separator=' ', strip=True)}: "
+            f"{LexborHTMLParser(article.get('desc', '')).text(separator=' ', strip=True)[:120]}"
+            for article in articles[:3]
+        )
+        # Empty results are not cached so the next turn retries
+        if result:
+            _KB_CACHE[search_term] = result
+        return result
+    except Exception:
         return ""
 
+async def fetch_all(phone: str, deadline_s: float = 2.0, known_contact_id: Optional[int] = None) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Fetch the caller's contact and recent tickets under one hard latency budget.
+
+    If `known_contact_id` (the id a previous lookup found for this phone) is
+    given, its tickets are fetched alongside the contact search and kept when
+    the id still matches. Everything runs in a TaskGroup; when the deadline
+    hits, whatever is still in flight is cancelled and partial results are
+    returned. The contact is None if the search itself didn't finish (as
+    opposed to {} for "no such contact").
+    """
+    contact_task = tickets_task = None
+    try:
+        async with asyncio.timeout(deadline_s), asyncio.TaskGroup() as tg:
+            contact_task = tg.create_task(search_contact_by_phone(phone))
+            if known_contact_id:
+                tickets_task = tg.create_task(get_latest_tickets(known_contact_id))
+            contact_id = (await contact_task).get("id")
+            if contact_id != known_contact_id:
+                if tickets_task is not None:
+                    tickets_task.cancel()
+                tickets_task = tg.create_task(get_latest_tickets(contact_id)) if contact_id else None
+    except TimeoutError:
+        logger.warning("[FETCH_ALL] Deadline of %ss hit, returning partial results", deadline_s)
+
+    def result_or(task, default):
+        if task is None or not task.done() or task.cancelled() or task.exception():
+            return default
+        return task.result()
+
+    return result_or(contact_task, None), result_or(tickets_task, [])
+
 async def create_ticket(call_id: str, description: str, phone: str = None, sentiment: str = "Neutral", requester_id: int = None) -> str:
     tags = ["Arta_Ai"]
     if sentiment:
@@ -188,76 +309,78 @@ async def create_ticket(call_id: str, description: str, phone: str = None, senti
         payload["phone"] = phone
     
     try:
-        async with httpx.AsyncClient(timeout=8) as client:
-            resp = await client.post(f"{FRESH_BASE}/tickets", json=payload, headers=FRESH_HEADERS)
-            if resp.status_code not in [200, 201]:
-                print(f" [TICKET] Create failed: {resp.status_code} - {resp.text}", flush=True)
-                return None
-                
-            data = resp.json()
-            # If standard response format
-            ticket_id = data.get("id") or data.get("ticket", {}).get("id")
-            if ticket_id:
-                print(f" Created New Ticket: {ticket_id}", flush=True)
-                return str(ticket_id)
+        client = await get_client()
+        resp = await client.post("/tickets", content=orjson.dumps(payload))
+        if resp.status_code not in [200, 201]:
+            logger.warning("[TICKET] Create failed: %s - %s", resp.status_code, resp.text)
             return None
+            
+        data = orjson.loads(resp.content)
+        # If standard response format
+        ticket_id = data.get("id") or data.get("ticket", {}).get("id")
+        if ticket_id:
+            logger.info("Created New Ticket: %s", ticket_id)
+            return str(ticket_id)
+        return None
     except Exception as e:
-        print(f" Ticket Creation Error: {e}", flush=True)
+        logger.error("Ticket Creation Error: %s", e)
         return None
 
 async def update_ticket_status(ticket_id: int, status: int = 4) -> bool:
     """Update a ticket status (default 4=Resolved, 5=Closed)."""
     try:
-        async with httpx.AsyncClient(timeout=8) as client:
-            url = f"{FRESH_BASE}/tickets/{ticket_id}"
-            resp = await client.put(url, json={"status": status}, headers=FRESH_HEADERS)
-            if resp.status_code in [200, 201]:
-                print(f" Ticket {ticket_id} status updated to {status}", flush=True)
-                return True
-            else:
-                print(f" Ticket update failed: {resp.status_code} - {resp.text}", flush=True)
-                return False
+        client = await get_client()
+        resp = await client.put(f"/tickets/{ticket_id}", content=orjson.dumps({"status": status}))
+        if resp.status_code in [200, 201]:
+            logger.info("Ticket %s status updated to %s", ticket_id, status)
+            return True
+        else:
+            logger.warning("Ticket update failed: %s - %s", resp.status_code, resp.text)
+            return False
     except Exception as e:
-        print(f" Ticket Update Error: {e}", flush=True)
+        logger.error("Ticket Update Error: %s", e)
         return False
 
 async def add_ticket_note(ticket_id: str, history: List[Dict]) -> bool:
-    """Add the full conversation history as a private note to the ticket."""
+    """Add the full conversation history as a private note to the ticket.
+
+    Called once, when the call completes, so a call costs a single note POST.
+    """
     if not ticket_id or not history:
         return False
     
     # Format the history into a clean HTML transcript
-    transcript = "<h3>Call Transcript (Arta AI)</h3><div style='font-family: sans-serif; line-height: 1.6;'>"
+    parts = [_NOTE_HEADER]
     
     for turn in history:
         role_label = turn.get("role", "user").capitalize()
         content = turn.get("content", "")
         
         # 1. Clean content (Strip all [ACTION: ...] tags for the agent)
-        clean_content = re.sub(r'\[ACTION:[^\]]+\]', '', content).strip()
+        clean_content = _ACTION_TAG.sub('', content).strip()
         
         # 2. Add to HTML with color-coded blocks
         if role_label.lower() == "user":
-            transcript += f"<p><b>User:</b> <span style='color: #2c3e50;'>{clean_content}</span></p>"
+            parts.append(f"<p><b>User:</b> <span style='color: #2c3e50;'>{clean_content}</span></p>")
         else:
-            transcript += f"<p><b>Assistant:</b> <span style='color: #2980b9;'>{clean_content}</span></p>"
+            parts.append(f"<p><b>Assistant:</b> <span style='color: #2980b9;'>{clean_content}</span></p>")
             
-    transcript += "</div><hr><p><small><i>Generated by Sandeza Support AI</i></small></p>"
+    parts.append(_NOTE_FOOTER)
+    transcript = "".join(parts)
     
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            url = f"{FRESH_BASE}/tickets/{ticket_id}/notes"
-            payload = {
-                "body": transcript,
-                "private": True
-            }
-            resp = await client.post(url, json=payload, headers=FRESH_HEADERS)
-            if resp.status_code in [200, 201, 202]:
-                print(f" [HISTORY] Conversation synced to ticket {ticket_id}", flush=True)
-                return True
-            else:
-                print(f" [HISTORY] Sync failed for ticket {ticket_id} (Status {resp.status_code}): {resp.text[:200]}", flush=True)
-                return False
+        client = await get_client()
+        payload = {
+            "body": transcript,
+            "private": True
+        }
+        resp = await client.post(f"/tickets/{ticket_id}/notes", content=orjson.dumps(payload), timeout=HTTP_TIMEOUTS["notes"])
+        if resp.status_code in [200, 201, 202]:
+            logger.info("[HISTORY] Conversation synced to ticket %s", ticket_id)
+            return True
+        else:
+            logger.warning("[HISTORY] Sync failed for ticket %s (Status %s): %s", ticket_id, resp.status_code, resp.text[:200])
+            return False
     except Exception as e:
-        print(f" [HISTORY] Sync error: {e}", flush=True)
+        logger.error("[HISTORY] Sync error: %s", e)
         return False
@@ -1,62 +1,76 @@
 import os
 import asyncio
-import base64
-import io
+import pybase64
 import logging
 import time
 import httpx
-import numpy as np
-import soundfile as sf
+import inspect
 import queue
+import struct
 import threading
-from groq import Groq
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from types import MappingProxyType
+from groq import AsyncGroq
+from typing import List, Dict, Any, Optional, Sequence
 from dotenv import load_dotenv
-from deepgram import DeepgramClient
-import time
+from deepgram import AsyncDeepgramClient, DeepgramClient
+from deepgram.core.events import EventType
+from deepgram.listen.v1.types.listen_v1results import ListenV1Results
+from deepgram.listen.v1.types.listen_v1utterance_end import ListenV1UtteranceEnd
 import re
 
+logger = logging.getLogger("app.groq")
+
 class DeepgramStreamer:
     """
     Connect-first Deepgram streamer with turn-taking logic.
-    Detects when user finishes speaking (silence after FINAL) and triggers callback.
+    Detects when user finishes speaking (endpointing's speech_final, with
+    UtteranceEnd as a fallback) and triggers callback.
     """
-    def __init__(self):
-        self.api_key = os.getenv("DEEPGRAM_API_KEY")
-        if not self.api_key:
-             print(" [ERROR] DEEPGRAM_API_KEY not found in .env")
-             return
-             
-        self.dg_client = DeepgramClient(api_key=self.api_key)
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        # Loop the speech-ended callback is dispatched onto (see set_speech_ended_callback)
+        self._loop = loop
+        self.api_key = DEEPGRAM_API_KEY
+        self.dg_client = None
         self.dg_connection = None
         self._context_manager = None
         self.final_transcript = ""
         self.current_utterance = ""  # Current speech segment
         self.is_connected = False
         self.packets_sent = 0
-        self.last_send_time = time.perf_counter()
         self.last_final_time = 0  # When we last got a FINAL transcript
         self._recv_thread = None
-        self._stop_receiver = threading.Event()
-        self._silence_timer = None
         self._speech_ended_callback = None
         self._barge_in_callback = None
-        self._silence_threshold = 0.3  # Reduced from 1.5 to 0.5 for ultra-fast response
+        if not self.api_key:
+             logger.error("DEEPGRAM_API_KEY not found in .env")
+             return
+             
+        self.dg_client = DeepgramClient(api_key=self.api_key)
         
     def set_speech_ended_callback(self, callback):
-        """Set callback to trigger when user finishes speaking."""
+        """Set callback to trigger when user finishes speaking.
+
+        If the streamer was given an event loop, the callback runs on that loop's
+        thread (coroutine functions are scheduled as tasks); otherwise it is called
+        directly on the Deepgram listener thread.
+        """
         self._speech_ended_callback = callback
-        print(f" [DEEPGRAM] Speech ended callback set", flush=True)
+        logger.debug("[DEEPGRAM] Speech ended callback set")
 
     def set_barge_in_callback(self, callback):
         """Set callback to trigger when user starts speaking (barge-in)."""
         self._barge_in_callback = callback
-        print(f" [DEEPGRAM] Barge-in callback set", flush=True)
+        logger.debug("[DEEPGRAM] Barge-in callback set")
         
     def connect(self):
         """Connect to Deepgram SYNCHRONOUSLY before accepting audio."""
+        if self.is_connected:
+            return True
+        if self.dg_client is None:
+            return False
         try:
-            print(" [DEEPGRAM] Connecting...", flush=True)
+            logger.info("[DEEPGRAM] Connecting...")
             
             options = {
                 "model": "nova-2",
@@ -65,106 +79,71 @@ class DeepgramStreamer:
                 "encoding": "linear16", 
                 "sample_rate": 16000,
                 "channels": 1,
+                # Turn ends on speech_final (300ms of silence); UtteranceEnd only
+                # backs it up when noise keeps endpointing from firing
                 "endpointing": 300,
+                "utterance_end_ms": 1000,
+                "vad_events": True,
             }
             
-            print(f" [DEEPGRAM] Options: {options}", flush=True)
+            logger.debug("[DEEPGRAM] Options: %s", options)
             
             # Connect using context manager
             self._context_manager = self.dg_client.listen.v1.connect(**options)
             self.dg_connection = self._context_manager.__enter__()
             
-            print(f" [DEEPGRAM] Connection type: {type(self.dg_connection)}", flush=True)
+            logger.debug("[DEEPGRAM] Connection type: %s", type(self.dg_connection))
             
             self.is_connected = True
             
-            # Start receiver thread
-            self._stop_receiver.clear()
-            self._recv_thread = threading.Thread(target=self._receiver_loop, daemon=True)
+            # Results arrive through SDK event callbacks; start_listening() drives
+            # the socket and dispatches them, so it gets its own daemon thread.
+            self.dg_connection.on(EventType.MESSAGE, self._on_message)
+            self.dg_connection.on(EventType.ERROR, self._on_error)
+            self.dg_connection.on(EventType.CLOSE, self._on_close)
+            self._recv_thread = threading.Thread(target=self.dg_connection.start_listening, daemon=True)
             self._recv_thread.start()
-            print(" [DEEPGRAM] Receiver thread started", flush=True)
+            logger.info("[DEEPGRAM] Listening for events")
             
-            print(" [DEEPGRAM] ✓ Connected and ready!", flush=True)
+            logger.info("[DEEPGRAM] ✓ Connected and ready!")
             return True
             
         except Exception as e:
-            print(f" [DEEPGRAM] ✗ Connection failed: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
+            logger.exception("[DEEPGRAM] ✗ Connection failed: %s", e)
             return False
     
-    def _receiver_loop(self):
-        """Dedicated thread to receive results - STAYS ALIVE."""
-        print(" [DG RECEIVER] Thread started", flush=True)
-        result_count = 0
-        consecutive_errors = 0
-        
-        while self.is_connected and not self._stop_receiver.is_set():
-            try:
-                if not self.dg_connection:
-                    time.sleep(0.5)
-                    continue
-                
-                result = self.dg_connection.recv()
-                
-                if result:
-                    result_count += 1
-                    consecutive_errors = 0
-                    self._process_result(result)
-                else:
-                    time.sleep(0.05)
-                    
-            except Exception as e:
-                error_str = str(e).lower()
-                if "timeout" in error_str:
-                    continue
-                if "closed" in error_str:
-                    break
-                consecutive_errors += 1
-                print(f" [DG RECEIVER] Error #{consecutive_errors}: {e}", flush=True)
-                if consecutive_errors > 10:
-                    break
-                time.sleep(0.1)
-        
-        print(f" [DG RECEIVER] Thread exited after {result_count} results", flush=True)
+    def _on_message(self, message):
+        """SDK MESSAGE callback - forward transcription results."""
+        if isinstance(message, ListenV1Results):
+            self._process_result(message)
+        elif isinstance(message, ListenV1UtteranceEnd):
+            self._on_silence_detected()
+
+    def _on_error(self, error):
+        logger.error("[DG RECEIVER] Error: %s", error)
+
+    def _on_close(self, _):
+        logger.info("[DG RECEIVER] Socket closed")
+        self.is_connected = False
     
-    def _process_result(self, result):
-        """Process a transcription result."""
+    def _process_result(self, result: ListenV1Results):
+        """Process a typed transcription result (layout is fixed by the SDK model)."""
         try:
-            transcript = None
-            is_final = False
-            
-            # Extract from SDK object
-            if hasattr(result, 'channel'):
-                try:
-                    alternatives = result.channel.alternatives
-                    if alternatives and len(alternatives) > 0:
-                        transcript = alternatives[0].transcript
-                        is_final = getattr(result, 'is_final', False)
-                except Exception as e:
-                    print(f" [DG] Parse error: {e}", flush=True)
-            
-            # Extract from dict
-            elif isinstance(result, dict):
-                channel = result.get('channel', {})
-                alternatives = channel.get('alternatives', [])
-                if alternatives:
-                    transcript = alternatives[0].get('transcript', '')
-                    is_final = result.get('is_final', False)
+            alternatives = result.channel.alternatives
+            if not alternatives:
+                return
+            transcript = alternatives[0].transcript
+            is_final = result.is_final
             
             if transcript and len(transcript.strip()) > 0:
                 if is_final:
-                    print(f" [DEEPGRAM LIVE] ✓ FINAL: '{transcript}'", flush=True)
+                    logger.info("[DEEPGRAM LIVE] ✓ FINAL: '%s'", transcript)
                     self.current_utterance += transcript.strip() + " "
                     self.final_transcript += transcript + " "
                     self.last_final_time = time.perf_counter()
-                    
-                    # Start/reset silence timer
-                    self._start_silence_timer()
                 else:
-                    print(f" [DEEPGRAM LIVE] → interim: '{transcript}'", flush=True)
-                    # Cancel silence timer - user is still speaking
-                    self._cancel_silence_timer()
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[DEEPGRAM LIVE] → interim: '%s'", transcript)
                     
                     # Manual Barge-in: Trigger if bot might be speaking
                     if self._barge_in_callback and len(transcript.strip()) > 3:
@@ -172,25 +151,17 @@ class DeepgramStreamer:
                             self._barge_in_callback()
                         except:
                             pass
+            
+            # Endpointing saw the speaker stop: end the turn now rather than
+            # waiting out utterance_end_ms (may arrive with an empty transcript)
+            if result.speech_final:
+                self._on_silence_detected()
                     
         except Exception as e:
-            print(f" [DG] Process error: {e}", flush=True)
-    
-    def _start_silence_timer(self):
-        """Start timer to detect end of speech."""
-        self._cancel_silence_timer()
-        self._silence_timer = threading.Timer(self._silence_threshold, self._on_silence_detected)
-        self._silence_timer.start()
-        print(f" [TURN] Starting {self._silence_threshold}s silence timer", flush=True)
-    
-    def _cancel_silence_timer(self):
-        """Cancel existing silence timer."""
-        if self._silence_timer:
-            self._silence_timer.cancel()
-            self._silence_timer = None
+            logger.error("[DG] Process error: %s", e)
     
     def _on_silence_detected(self):
-        """Called when silence threshold is reached after FINAL transcript."""
+        """Called on speech_final or UtteranceEnd; whichever comes second finds nothing to flush."""
         if not self.current_utterance:
             return
         
@@ -200,17 +171,24 @@ class DeepgramStreamer:
         transcript = self.current_utterance
         self.current_utterance = ""  # Clear for next turn
         
-        print(f" [TURN] 🎤 User finished speaking: '{transcript}'", flush=True)
-        print(f" [LATENCY] Silence detection (ASR Turn End) took {silence_duration:.3f}s", flush=True)
+        logger.info("[TURN] 🎤 User finished speaking: '%s'", transcript)
+        logger.debug("[LATENCY] Silence detection (ASR Turn End) took %.3fs", silence_duration)
         
-        if self._speech_ended_callback:
+        callback = self._speech_ended_callback
+        if callback and self._loop is not None:
+            if inspect.iscoroutinefunction(callback):
+                future = asyncio.run_coroutine_threadsafe(callback(transcript), self._loop)
+                future.add_done_callback(_log_turn_error)
+            else:
+                self._loop.call_soon_threadsafe(callback, transcript)
+        elif callback:
             try:
                 cb_start = time.perf_counter()
                 self._speech_ended_callback(transcript)
                 cb_duration = time.perf_counter() - cb_start
-                print(f" [LATENCY] User turn callback execution took {cb_duration:.3f}s", flush=True)
+                logger.debug("[LATENCY] User turn callback execution took %.3fs", cb_duration)
             except Exception as e:
-                print(f" [TURN] Callback error: {e}", flush=True)
+                logger.error("[TURN] Callback error: %s", e)
     
     def get_current_utterance(self):
         """Get and clear the current utterance."""
@@ -219,85 +197,136 @@ class DeepgramStreamer:
         return transcript
 
     async def send_audio(self, chunk: bytes):
-        """Send audio DIRECTLY - NO QUEUING."""
+        """Send audio DIRECTLY - NO QUEUING.
+
+        The frame is forwarded as received from the websocket; no copy is made here.
+        """
         if not self.is_connected or not self.dg_connection:
             return
         
         if self.packets_sent == 0:
-            print(f" [DEEPGRAM] First packet: {len(chunk)} bytes", flush=True)
+            logger.info("[DEEPGRAM] First packet: %s bytes", len(chunk))
         
         try:
             self.dg_connection.send_media(chunk)
             self.packets_sent += 1
-            self.last_send_time = time.perf_counter()
             
-            if self.packets_sent % 50 == 0:
-                print(f" [DEEPGRAM] Sent {self.packets_sent} packets", flush=True)
+            if self.packets_sent % 50 == 0 and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[DEEPGRAM] Sent %s packets", self.packets_sent)
                 
         except Exception as e:
-            print(f" [DEEPGRAM] Send error: {e}", flush=True)
+            logger.error("[DEEPGRAM] Send error: %s", e)
             self.is_connected = False
 
     def close(self):
         """Cleanup connection."""
-        print(" [DEEPGRAM] Closing...", flush=True)
+        logger.info("[DEEPGRAM] Closing...")
         self.is_connected = False
-        self._stop_receiver.set()
-        self._cancel_silence_timer()
-        
-        if self._recv_thread and self._recv_thread.is_alive():
-            self._recv_thread.join(timeout=2.0)
         
         try:
             if self._context_manager:
+                # Closing the socket ends start_listening() on the listener thread
                 self._context_manager.__exit__(None, None, None)
-                print(f" [DEEPGRAM] Closed. Sent {self.packets_sent} packets", flush=True)
+                logger.info("[DEEPGRAM] Closed. Sent %s packets", self.packets_sent)
         except Exception as e:
-            print(f" [DEEPGRAM] Close error: {e}", flush=True)
+            logger.error("[DEEPGRAM] Close error: %s", e)
+        
+        if self._recv_thread and self._recv_thread.is_alive():
+            self._recv_thread.join(timeout=2.0)
+
+
+def _log_turn_error(future):
+    """Done-callback for scheduled speech-ended coroutines, whose results nobody awaits."""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("[TURN] Callback error: %s", future.exception(), exc_info=future.exception())
 
 
 #  WINDOWS ASYNC FIX
 if os.name == 'nt':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+# Searches upward from this file, so app/.env and the project-root .env are both covered
 load_dotenv()
 
-#  MULTIPLE .env LOADING
-dotenv_paths = [
-    os.path.join(os.path.dirname(__file__), '.env'),
-    os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'),
-    '.env'
-]
-
-for path in dotenv_paths:
-    if os.path.exists(path):
-        load_dotenv(path)
-        print(f" .env loaded: {path}")
-        break
-
-logger = logging.getLogger("app.groq")
+# Env is fixed at process start; read each key once here
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+WHISPER_API_KEY = os.getenv("WHISPER_API_KEY")
+DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
 GROQ_ENABLED = bool(GROQ_API_KEY)
 
-print(f" GROQ: {' READY' if GROQ_ENABLED else ' KEY MISSING'}")
+logger.info("GROQ: %s", "READY" if GROQ_ENABLED else "KEY MISSING")
+
+# Created at import so the first turn doesn't pay for client setup
+_client: Optional[AsyncGroq] = AsyncGroq(api_key=GROQ_API_KEY) if GROQ_ENABLED else None
+
+def _get_client() -> Optional[AsyncGroq]:
+    return _client
+
+_whisper_client: Optional[AsyncGroq] = None
+
+def _get_whisper_client() -> Optional[AsyncGroq]:
+    """Dedicated Whisper client if WHISPER_API_KEY is set, else the shared Groq client."""
+    global _whisper_client
+    if not WHISPER_API_KEY:
+        return _get_client()
+
+    if _whisper_client is None:
+        _whisper_client = AsyncGroq(api_key=WHISPER_API_KEY)
+    return _whisper_client
 
-_client: Optional[Groq] = None
+_deepgram_client: Optional[AsyncDeepgramClient] = None
 
-def _get_client() -> Optional[Groq]:
-    global _client
-    if not GROQ_ENABLED:
+def _get_deepgram_client() -> Optional[AsyncDeepgramClient]:
+    """Shared async Deepgram client for prerecorded (batch) transcription."""
+    global _deepgram_client
+    if not DEEPGRAM_API_KEY:
         return None
 
-    if _client is not None:
-        return _client
+    if _deepgram_client is None:
+        _deepgram_client = AsyncDeepgramClient(api_key=DEEPGRAM_API_KEY)
+    return _deepgram_client
 
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Shared pooled client for recording downloads (keeps TLS to Vonage storage warm)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=10.0
+        )
+    return _http_client
+
+async def aclose():
+    """Close the shared download client (called on app shutdown)."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+async def _warm_groq():
+    """Force the Groq client to open its pool and finish TLS to api.groq.com."""
+    client = _get_client()
+    if client is None:
+        return
     try:
-        _client = Groq(api_key=GROQ_API_KEY)
-        print(" Groq client (Whisper + Llama) ready!")
-        return _client
+        await client.models.list()
     except Exception as e:
-        print(f" Groq init: {e}")
-        return None
+        logger.warning("[WARMUP] Groq warm-up failed: %s", e)
+
+async def warm_up(streamer: Optional[DeepgramStreamer] = None, groq: bool = True) -> bool:
+    """Pay the Deepgram WS handshake and Groq TLS setup before the first turn.
+
+    Pass groq=False when the call was already warmed (e.g. by /voice/answer).
+    Safe to call repeatedly. Returns whether the streamer (if given) is connected.
+    """
+    jobs = [_warm_groq()] if groq else []
+    if streamer is not None:
+        jobs.append(asyncio.to_thread(streamer.connect))
+    results = await asyncio.gather(*jobs)
+    return streamer is None or bool(results[-1])
 
 HUMAN_PROMPT = """You are "Sandeza Freshdesk Support Pro", an expert L1 support agent dedicated EXCLUSIVELY to Freshdesk.
 
@@ -379,32 +408,37 @@ TICKET RESOLUTION & TERMINATION (STRICT SEQUENCE):
     - Example: "I'm glad I could help! Have a wonderful day. [ACTION: RESOLVE_TICKET] [ACTION: HANGUP]"
 """
 
+# Fixed part of the 44-byte WAV header for 16kHz / mono / 16-bit PCM:
+# "WAVE" + fmt chunk + "data" (only the two size fields vary per call)
+_WAV_HEADER_MID = b"WAVE" + struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, 1, 16000, 32000, 2, 16) + b"data"
+
+# Longest turn we transcribe: 30s of 16kHz/16-bit PCM (960KB), base64-encoded.
+# Bigger payloads are dropped before decoding so they can't stall the loop.
+MAX_AUDIO_PCM_BYTES = 30 * 32000
+MAX_AUDIO_B64_LEN = 4 * -(-MAX_AUDIO_PCM_BYTES // 3)
+
+def _audio_too_large(audio_data: str, engine: str) -> bool:
+    if len(audio_data) > MAX_AUDIO_B64_LEN:
+        logger.warning("[%s] Dropping oversized audio payload (%s base64 chars)", engine, len(audio_data))
+        return True
+    return False
+
 def pcm16_to_wav_bytes(pcm_bytes: bytes) -> bytes:
-    """Fast local conversion: Raw PCM (16kHz) -> WAV bytes for Groq."""
-    try:
-        # 16-bit PCM to float32 normalized
-        audio = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
-        buffer = io.BytesIO()
-        # Save as standard WAV so Groq can read it instantly
-        sf.write(buffer, audio, samplerate=16000, format="WAV")
-        buffer.seek(0)
-        return buffer.read()
-    except Exception as e:
-        print(f" PCM conversion failed: {e}")
-        return pcm_bytes
+    """Fast local conversion: Raw PCM (16kHz) -> WAV bytes for Groq.
+
+    The audio is already 16-bit mono PCM, so we only prepend a RIFF header.
+    """
+    size = len(pcm_bytes)
+    if size > MAX_AUDIO_PCM_BYTES:
+        raise ValueError(f"PCM payload too large: {size} bytes")
+    return b"RIFF" + struct.pack("<I", 36 + size) + _WAV_HEADER_MID + struct.pack("<I", size) + pcm_bytes
 
 async def transcribe_whisper(audio_data: Optional[str]) -> Optional[str]:
     """Groq Whisper-Large-v3 (95%+ accuracy)."""
     if not audio_data:
         return None
     
-    # Check for dedicated Whisper key, otherwise fall back to shared Groq client
-    whisper_key = os.getenv("WHISPER_API_KEY")
-    if whisper_key:
-        client = Groq(api_key=whisper_key)
-    else:
-        client = _get_client()
-        
+    client = _get_whisper_client()
     if not client:
         return None
     
@@ -412,39 +446,36 @@ async def transcribe_whisper(audio_data: Optional[str]) -> Optional[str]:
         # Handle different audio formats from Vonage
         if audio_data.startswith('http'):
             # Download audio URL (Vonage recording) - SLOW PATH (Fallback)
-            async with httpx.AsyncClient() as http_client:
-                resp = await http_client.get(audio_data)
-                audio_bytes = resp.content
-                filename = "audio.wav"
+            resp = await _get_http_client().get(audio_data)
+            audio_bytes = resp.content
+            filename, mime = "audio.wav", "audio/wav"
         else:
             # Base64 audio - FAST PATH (Direct PCM)
-            raw_bytes = base64.b64decode(audio_data)
-            # Check if it's already a WAV/WebM container, if not treat as PCM
-            if raw_bytes.startswith(b'RIFF') or raw_bytes.startswith(b'\x1a\x45\xdf\xa3'):
-                audio_bytes = raw_bytes
+            if _audio_too_large(audio_data, "ASR: WHISPER"):
+                return None
+            raw_bytes = pybase64.b64decode(audio_data, validate=False)
+            # Containers are uploaded as decoded; only raw PCM gets a WAV header
+            if raw_bytes.startswith(b'RIFF'):
+                audio_bytes, filename, mime = raw_bytes, "audio.wav", "audio/wav"
+            elif raw_bytes.startswith(b'\x1a\x45\xdf\xa3'):
+                audio_bytes, filename, mime = raw_bytes, "audio.webm", "audio/webm"
             else:
-                # Convert raw PCM to WAV using the user's logic
-                audio_bytes = pcm16_to_wav_bytes(raw_bytes)
-            filename = "audio.wav"
+                audio_bytes, filename, mime = pcm16_to_wav_bytes(raw_bytes), "audio.wav", "audio/wav"
         
-        # Whisper transcription
-        loop = asyncio.get_event_loop()
-        transcript = await loop.run_in_executor(
-            None,
-            lambda: client.audio.transcriptions.create(
-                file=(filename, io.BytesIO(audio_bytes), "audio/wav"),
-                model="whisper-large-v3",
-                response_format="text",
-                language="en"
-            )
+        # Whisper transcription (the SDK takes the bytes as-is, no file wrapper needed)
+        transcript = await client.audio.transcriptions.create(
+            file=(filename, audio_bytes, mime),
+            model="whisper-large-v3",
+            response_format="text",
+            language="en"
         )
         
         text = str(transcript).strip()
-        print(f" [ASR: WHISPER] Transcript: '{text}'", flush=True)
+        logger.info("[ASR: WHISPER] Transcript: '%s'", text)
         return text if len(text) > 1 else None
         
     except Exception as e:
-        print(f" Whisper: {e}")
+        logger.warning("[ASR: WHISPER] Failed: %s", e)
         return None
 
 async def transcribe_deep(audio_data: Optional[str]) -> Optional[str]:
@@ -452,88 +483,106 @@ async def transcribe_deep(audio_data: Optional[str]) -> Optional[str]:
     Expects base64-encoded PCM audio from Vonage.
     """
     if not audio_data:
-        print(" [DEEPGRAM] No audio data provided", flush=True)
+        logger.info("[DEEPGRAM] No audio data provided")
         return None
     
-    api_key = os.getenv("DEEPGRAM_API_KEY")
-    if not api_key:
-        print(" [DEEPGRAM] CRITICAL ERROR: API KEY MISSING! Check .env file.", flush=True)
+    client = _get_deepgram_client()
+    if not client:
+        logger.error("[DEEPGRAM] CRITICAL ERROR: API KEY MISSING! Check .env file.")
+        return None
+    if _audio_too_large(audio_data, "DEEPGRAM"):
         return None
 
     try:
-        # Decode base64 and convert raw PCM to WAV
-        raw_bytes = base64.b64decode(audio_data)
-        audio_bytes = pcm16_to_wav_bytes(raw_bytes)
-        
-        st = time.time()
-        
-        # Use simple sync client in a thread for now to match current turn-based flow
-        client = DeepgramClient(api_key)
-        options = {
-            "model": "nova-3",
-            "smart_format": True,
-            "language": "en",
-            "punctuate": True,
-            "utterances": False
-        }
+        # Decode base64; Deepgram takes the raw PCM as-is (no WAV container)
+        audio_bytes = pybase64.b64decode(audio_data, validate=False)
         
-        payload = {"buffer": audio_bytes}
+        st = time.perf_counter()
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.listen.prerecorded.v("1").transcribe_file(payload, options)
+        # Passed as bytes, not a reader: the decoded PCM is already the only copy
+        # (no WAV), so a stream source would save no memory and only switch the
+        # upload to chunked transfer encoding
+        response = await client.listen.v1.media.transcribe_file(
+            request=audio_bytes,
+            model="nova-3",
+            smart_format=True,
+            language="en",
+            punctuate=True,
+            utterances=False,
+            encoding="linear16",
+            # Raw PCM has no header, so the format goes on the query string
+            request_options={"additional_query_parameters": {"sample_rate": 16000, "channels": 1}}
         )
         
         # More robust transcript extraction
         if response and response.results and response.results.channels:
             text = response.results.channels[0].alternatives[0].transcript.strip()
             confidence = response.results.channels[0].alternatives[0].confidence if hasattr(response.results.channels[0].alternatives[0], 'confidence') else 'N/A'
-            print(f" [ASR: DEEPGRAM] Transcript: '{text}' (Confidence: {confidence}, Time: {time.time()-st:.2f}s)", flush=True)
+            logger.info("[ASR: DEEPGRAM] Transcript: '%s' (Confidence: %s, Time: %.2fs)", text, confidence, time.perf_counter()-st)
             return text if len(text) > 0 else None
         else:
-            print(f" [DEEPGRAM] Empty response structure", flush=True)
+            logger.info("[DEEPGRAM] Empty response structure")
             return None
 
     except Exception as e:
-        print(f" [DEEPGRAM] SDK Exception: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        logger.exception("[DEEPGRAM] SDK Exception: %s", e)
         return None
 
-async def agent_response(issue: str, kb: str, history: List[Dict], contact_name: Optional[str] = None, recent_tickets: List[Dict] = [], phone: Optional[str] = None, max_tokens: int = 500, temperature: float = 0.2, **kwargs) -> str:
-    """Detailed and helpful 70B response."""
-    client = _get_client()
-    if not client:
-        return "Let me check. Clear cache. Does that work?"
-    
+# Compiled once; these run on every turn
+_RE_HAS_LETTER = re.compile(r'[a-zA-Z]')
+_RE_USE_TICKET = re.compile(r'\[ACTION: USE_TICKET: (\d+)\]')
+_RE_PREVIOUS_ISSUE = re.compile(r'previous issue|past issue|status|already talked|my ticket', re.IGNORECASE)
+_RE_ID_NUM = re.compile(r'\(?ID:\s*\d+\)?', re.IGNORECASE)
+_RE_TICKET_ID = re.compile(r'ticket\s+id\s*[:#]?\s*\d*', re.IGNORECASE)
+
+# Freshdesk status/priority codes as shown to the LLM
+_STATUS_MAP = MappingProxyType({2: "Open", 3: "Pending", 4: "Resolved", 5: "Closed"})
+_PRIORITY_MAP = MappingProxyType({1: "Low", 2: "Medium", 3: "High", 4: "Urgent"})
+_HIGH_PRIORITIES = (3, 4)
+
+# Prompt sections, built once
+_CREATE_TICKET_REMINDER = "CRITICAL: If new issue, user said 'No' to previous contact, AND NO ACTIVE_SESSION_TICKET_ID exists, you MUST include [ACTION: CREATE_TICKET: Description]. If existing ticket matches and user confirms, you MUST include [ACTION: USE_TICKET: ID]."
+_PREVIOUS_ISSUE_ALERT = "USER INTENT ALERT: User has explicitly asked about a PREVIOUS issue or STATUS. Do NOT ask if they have contacted an agent before. Proceed directly to Step 3 (Ticket Matching)."
+_HIGH_PRIORITY_MANDATE = "CRITICAL MANDATE: One or more tickets in HISTORY/RECENT_TICKETS are HIGH PRIORITY. You MUST APOLOGIZE and OFFER A TRANSFER immediately if this matches the user's issue. DO NOT mention the 'Ticket ID' number."
+
+# Per-turn sections, filled positionally with str.format
+_CUSTOMER_INFO_TMPL = "CUSTOMER INFO: Talking to {}."
+_TICKET_LINE_TMPL = "- ID: {}, Status: {}, Priority: {} ({}), Subject: {}, Description: {}"
+_RECENT_TICKETS_TMPL = "RECENT_TICKETS (Max 2):\n{}"
+_ACTIVE_TICKET_TMPL = "ACTIVE_SESSION_TICKET_ID: {}. [PRIORITY: {}]. User has confirmed this is their issue. Use ticket notes to solve.{}"
+_ACTIVE_HIGH_ATTENTION = "\nATTENTION: This is a HIGH PRIORITY ticket. Offer transfer now if you haven't already. (Choice: 'Transfer to live agent' or 'Continue with me')."
+
+def _build_messages(issue: str, kb: str, history: Sequence[Dict], contact_name: Optional[str] = None, recent_tickets: List[Dict] = [], phone: Optional[str] = None, **kwargs) -> List[Dict]:
+    """Assemble the system prompt + history + user turn for the LLM."""
     # Debug: See what the AI is receiving
-    print(f"DEBUG KB SENDING ({len(kb)} chars): {kb[:100]}...")
+    logger.debug("KB SENDING (%s chars): %s...", len(kb), kb[:100])
 
-    # Inject contact name and tickets into system prompt if available
-    context_prompt = HUMAN_PROMPT
+    # Inject contact name and tickets into system prompt if available.
+    # Sections are collected in a list and joined once at the end.
+    prompt_parts = [HUMAN_PROMPT.replace("[Phone]", phone) if phone else HUMAN_PROMPT]
     
     # Sanitize contact_name: If it's just a number, treat as Unknown to LLM
     display_name = contact_name
-    if display_name and not re.search(r'[a-zA-Z]', str(display_name)):
+    if display_name and not _RE_HAS_LETTER.search(str(display_name)):
         display_name = "Unknown"
         
     if display_name:
-        context_prompt += f"\n\nCUSTOMER INFO: Talking to {display_name}."
-    
-    if phone:
-        context_prompt = context_prompt.replace("[Phone]", phone)
+        prompt_parts.append(_CUSTOMER_INFO_TMPL.format(display_name))
     
     if recent_tickets:
-        status_map = {2: "Open", 3: "Pending", 4: "Resolved", 5: "Closed"}
-        priority_map = {1: "Low", 2: "Medium", 3: "High", 4: "Urgent"}
-        
         ticket_data = "\n".join([
-            f"- ID: {t.get('id')}, Status: {status_map.get(t.get('status'), 'Unknown')}, Priority: {priority_map.get(t.get('priority'), 'Unknown')} ({t.get('priority')}), Subject: {t.get('subject')}, Description: {t.get('description', 'No description available.')}"
+            _TICKET_LINE_TMPL.format(
+                t.get('id'),
+                _STATUS_MAP.get(t.get('status'), 'Unknown'),
+                _PRIORITY_MAP.get(t.get('priority'), 'Unknown'),
+                t.get('priority'),
+                t.get('subject'),
+                t.get('description', 'No description available.')
+            )
             for t in recent_tickets
         ])
-        print(f" [ANALYSIS] Comparing User Issue: '{issue}' against {len(recent_tickets)} Recent Tickets...")
-        context_prompt += f"\n\nRECENT_TICKETS (Max 2):\n{ticket_data}"
+        logger.info("[ANALYSIS] Comparing User Issue: '%s' against %s Recent Tickets...", issue, len(recent_tickets))
+        prompt_parts.append(_RECENT_TICKETS_TMPL.format(ticket_data))
     
     # Check if we have a ticket created for this current call
     active_id = kwargs.get("active_ticket_id")
@@ -541,21 +590,15 @@ async def agent_response(issue: str, kb: str, history: List[Dict], contact_name:
         # Detect confirmed ticket from history
         for msg in reversed(history):
             if msg.get("role") == "assistant":
-                match = re.search(r'\[ACTION: USE_TICKET: (\d+)\]', msg.get("content", ""))
+                match = _RE_USE_TICKET.search(msg.get("content", ""))
                 if match:
                     active_id = match.group(1)
                     break
 
     # 4. Check for High/Urgent Priority in ANY recent ticket (Global Warning)
-    has_high_priority = False
-    for t in recent_tickets:
-        if t.get('priority') in [3, 4]:
-            has_high_priority = True
-            break
-            
-    if has_high_priority:
-        print(f" [PRIORITY] High/Urgent ticket detected in Recent Tickets!", flush=True)
-        context_prompt += "\n\nCRITICAL MANDATE: One or more tickets in HISTORY/RECENT_TICKETS are HIGH PRIORITY. You MUST APOLOGIZE and OFFER A TRANSFER immediately if this matches the user's issue. DO NOT mention the 'Ticket ID' number."
+    if any(t.get('priority') in _HIGH_PRIORITIES for t in recent_tickets):
+        logger.info("[PRIORITY] High/Urgent ticket detected in Recent Tickets!")
+        prompt_parts.append(_HIGH_PRIORITY_MANDATE)
 
     if active_id:
         # Check priority of active ticket specifically
@@ -563,65 +606,78 @@ async def agent_response(issue: str, kb: str, history: List[Dict], contact_name:
         for t in recent_tickets:
             if str(t.get('id')) == str(active_id):
                 p = t.get('priority')
-                if p in [3, 4]:
+                if p in _HIGH_PRIORITIES:
                     priority_str = "HIGH/URGENT"
                 break
         
-        print(f" [PRIORITY] Active Ticket {active_id} is {priority_str}", flush=True)
-        context_prompt += f"\n\nACTIVE_SESSION_TICKET_ID: {active_id}. [PRIORITY: {priority_str}]. User has confirmed this is their issue. Use ticket notes to solve."
-        if priority_str == "HIGH/URGENT":
-             context_prompt += "\nATTENTION: This is a HIGH PRIORITY ticket. Offer transfer now if you haven't already. (Choice: 'Transfer to live agent' or 'Continue with me')."
+        logger.info("[PRIORITY] Active Ticket %s is %s", active_id, priority_str)
+        attention = _ACTIVE_HIGH_ATTENTION if priority_str == "HIGH/URGENT" else ""
+        prompt_parts.append(_ACTIVE_TICKET_TMPL.format(active_id, priority_str, attention))
 
     # FINAL REMINDER: Always include [ACTION: CREATE_TICKET: Description] for new issues!
-    context_prompt += "\n\nCRITICAL: If new issue, user said 'No' to previous contact, AND NO ACTIVE_SESSION_TICKET_ID exists, you MUST include [ACTION: CREATE_TICKET: Description]. If existing ticket matches and user confirms, you MUST include [ACTION: USE_TICKET: ID]."
+    prompt_parts.append(_CREATE_TICKET_REMINDER)
 
     # 5. Detect explicit mention of Previous Issue to skip Step 2
-    issue_lower = issue.lower()
-    if any(phrase in issue_lower for phrase in ["previous issue", "past issue", "status", "already talked", "my ticket"]):
-         print(f" [INTENT] User is asking about an existing issue. Prompting AI to bypass verification.", flush=True)
-         context_prompt += "\n\nUSER INTENT ALERT: User has explicitly asked about a PREVIOUS issue or STATUS. Do NOT ask if they have contacted an agent before. Proceed directly to Step 3 (Ticket Matching)."
+    if _RE_PREVIOUS_ISSUE.search(issue):
+         logger.info("[INTENT] User is asking about an existing issue. Prompting AI to bypass verification.")
+         prompt_parts.append(_PREVIOUS_ISSUE_ALERT)
 
+    # Last 12 turns without slicing a copy (works for list or deque history)
     messages = [
-        {"role": "system", "content": context_prompt},
-        *history[-12:],
+        {"role": "system", "content": "\n\n".join(prompt_parts)},
+        *islice(history, max(len(history) - 12, 0), None),
         {"role": "user", "content": f"Issue: {issue}\n\nKB Context:\n{kb or 'No specific Freshdesk KB path found - provide a standard L1 solution.'}"}
     ]
-    
+    return messages
+
+def _scrub(response: str) -> str:
+    # FAILSAFE: Strip any unintentional Ticket ID mentions
+    response = _RE_ID_NUM.sub('', response)
+    response = _RE_TICKET_ID.sub('', response)
+    return response.replace("  ", " ").strip()
+
+async def agent_response(issue: str, kb: str, history: Sequence[Dict], contact_name: Optional[str] = None, recent_tickets: List[Dict] = [], phone: Optional[str] = None, max_tokens: int = 500, temperature: float = 0.2, **kwargs) -> str:
+    """Detailed and helpful 70B response.
+
+    One non-streamed completion: Vonage's PUT /talk replaces whatever is still
+    playing, so the reply is spoken as a single talk and streaming would not
+    bring the first audio any earlier.
+    """
+    client = _get_client()
+    if not client:
+        return "Let me check. Clear cache. Does that work?"
+
+    messages = _build_messages(issue, kb, history, contact_name, recent_tickets, phone, **kwargs)
+
     try:
-        loop = asyncio.get_event_loop()
         start_llm = time.perf_counter()
-        resp = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="llama-3.1-8b-instant",     #model is here dude "meta-llama/llama-4-maverick-17b-128e-instruct"............    #model is here dude ............
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
+        resp = await client.chat.completions.create(
+            model="llama-3.1-8b-instant",     #model is here dude "meta-llama/llama-4-maverick-17b-128e-instruct"............    #model is here dude ............
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
         )
         llm_duration = time.perf_counter() - start_llm
-        
-        response = resp.choices[0].message.content.strip()
-        
-        # FAILSAFE: Strip any unintentional Ticket ID mentions
-        response = re.sub(r'\(?ID:\s*\d+\)?', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'ticket\s+id\s*[:#]?\s*\d*', '', response, flags=re.IGNORECASE)
-        response = response.replace("  ", " ").strip()
-        
-        print(f" AI: {response[:150]}...")
-        print(f" [LATENCY] LLM (Llama) generation took {llm_duration:.3f}s", flush=True)
+
+        response = _scrub(resp.choices[0].message.content or "")
+        logger.info("AI: %s...", response[:150])
+        logger.debug("[LATENCY] LLM (Llama) generation took %.3fs", llm_duration)
         return response
-        
+
     except Exception as e:
         err_msg = str(e)
-        print(f" [ERROR] Llama Failure: {err_msg}")
+        logger.error("[ERROR] Llama Failure: %s", err_msg)
         if "429" in err_msg:
             return "I'm sorry, I'm experiencing a high volume of requests right now. Please wait a few seconds and try again so I can assist you better."
         return "I'm sorry, I encountered an internal error. Please tell me more about the problem so I can help?"
 
 #  BACKWARD COMPATIBLE: Keep old function name
 async def process_audio(audio_data: Optional[str], kb: str, history: List[Dict]) -> str:
-    """Full pipeline: ASR → Llama LLM."""
+    """Full pipeline: ASR → Llama LLM.
+
+    The live websocket path never comes through here: DeepgramStreamer's
+    speech-ended callback calls agent_response directly.
+    """
     
     # --- ASR SELECTION ---
     # Option A: Deepgram (Fastest)
@@ -638,5 +694,5 @@ async def process_audio(audio_data: Optional[str], kb: str, history: List[Dict])
     start_time = time.perf_counter()
     response = await agent_response(issue, kb, history)
     duration = time.perf_counter() - start_time
-    print(f" [LATENCY] agent_response took {duration:.3f}s", flush=True)
+    logger.debug("[LATENCY] agent_response took %.3fs", duration)
     return response
@@ -1,8 +1,13 @@
 import os
-import re
-import traceback
+import logging
+import asyncio
+import threading
 import time
-from typing import List, Dict
+import orjson
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import List, Dict, Optional
 from fastapi import FastAPI, Request, WebSocket
 from dotenv import load_dotenv
 
@@ -10,69 +15,118 @@ from dotenv import load_dotenv
 load_dotenv()
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+AGENT_NUMBER = os.getenv("AGENT_NUMBER", "18335645478")
+
+from .logs import setup_logging
+setup_logging()
+
 from .state import ConversationState
-from .voice import handle_voice_answer, handle_voice_asr, handle_voice_events, inject_vonage_tts, stop_vonage_tts, transfer_to_agent
+from .voice import handle_voice_answer, handle_voice_asr, handle_voice_events, inject_vonage_tts, stop_vonage_tts, transfer_to_agent, arm_hangup_after_talk, spawn
 from .freshdesk import create_ticket, update_ticket_status, update_contact_name, create_contact
-from fastapi.responses import JSONResponse
+from . import freshdesk
+from . import groq
+from . import voice
+from .responses import ORJSONResponse
+
+# [ACTION: ...] / [SENTIMENT: ...] tags in the LLM reply
+_TAG_PREFIXES = (("ACTION", "[ACTION:"), ("SENTIMENT", "[SENTIMENT:"))
+
+def _split_tags(text: str):
+    """Single pass over `text`: return its (type, content) tags and the text with tags removed.
+
+    A str.find/startswith scan rather than a regex: replies are short and most
+    sentences carry no tag at all. Content runs from the colon (leading
+    whitespace dropped) to the next ']', and must be non-empty.
+    """
+    if "[" not in text:
+        return [], text.strip()
+    tags, parts, last = [], [], 0
+    find, startswith = text.find, text.startswith
+    pos = find("[")
+    while pos != -1:
+        for tag_type, prefix in _TAG_PREFIXES:
+            if startswith(prefix, pos):
+                break
+        else:
+            pos = find("[", pos + 1)
+            continue
+        start = pos + len(prefix)
+        end = find("]", start)
+        if end == -1:
+            break
+        raw = text[start:end]
+        content = raw.lstrip() or raw[-1:]
+        if not content:
+            pos = find("[", pos + 1)
+            continue
+        tags.append((tag_type, content))
+        parts.append(text[last:pos])
+        last = end + 1
+        pos = find("[", last)
+    parts.append(text[last:])
+    return tags, "".join(parts).strip()
+
+logger = logging.getLogger("app.main")
 
 call_state = ConversationState()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Run new tasks eagerly until their first real suspension
+    asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    yield
+    # Release pooled HTTP connections
+    await freshdesk.aclose()
+    await groq.aclose()
+    await voice.aclose()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Add exception middleware to catch ALL errors
 @app.middleware("http")
 async def catch_exceptions_middleware(request: Request, call_next):
+    # Per-request access logging is uvicorn's job; only trace here at DEBUG
+    debug = logger.isEnabledFor(logging.DEBUG)
     try:
-        print(f" [REQUEST] {request.method} {request.url.path}", flush=True)
+        if debug:
+            logger.debug("[REQUEST] %s %s", request.method, request.url.path)
         response = await call_next(request)
-        print(f" [RESPONSE] {response.status_code}", flush=True)
+        if debug:
+            logger.debug("[RESPONSE] %s", response.status_code)
         return response
     except Exception as e:
-        print(f" [MIDDLEWARE ERROR] {type(e).__name__}: {e}", flush=True)
-        traceback.print_exc()
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        logger.exception("[MIDDLEWARE ERROR] %s: %s", type(e).__name__, e)
+        return ORJSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.get("/")
 async def health():
     return {"status": "DEBUG_MODE_LOGGING_ACTIVE", "calls": len(call_state.calls)}
 
+# NCCO: Talk Only (Debug). Websocket variant (append as a second action):
+# {
+#     "action": "connect",
+#     "endpoint": [{
+#         "type": "websocket",
+#         "uri": "wss://<PUBLIC_URL host>/voice/stream",
+#         "content-type": "audio/l16;rate=16000",
+#         "headers": {
+#             "uuid": call_uuid
+#         }
+#     }]
+# }
 @app.get("/voice/tts")
 async def tts_ncco(request: Request):
     """
     Serves the NCCO for TTS injection dynamically.
     This works around inline NCCO validation issues.
     """
-    params = dict(request.query_params)
+    params = request.query_params
     text = params.get("text", "Processing...")
     call_uuid = params.get("uuid", "")
     
-    # Construct Websocket URL
-    public_url = os.getenv("PUBLIC_URL", "")
-    ws_url = public_url.replace("http://", "ws://").replace("https://", "wss://") + "/voice/stream"
-    
-    # Generate NCCO: Talk Only (Debug)
-    ncco = [
-        {
-            "action": "talk",
-            "text": text,
-            "bargeIn": True,
-            "language": "en-US"
-        }
-        # {
-        #     "action": "connect",
-        #     "endpoint": [{
-        #         "type": "websocket",
-        #         "uri": ws_url,
-        #         "content-type": "audio/l16;rate=16000",
-        #         "headers": {
-        #             "uuid": call_uuid
-        #         }
-        #     }]
-        # }
-    ]
-    
-    print(f" [TTS_NCCO] Serving NCCO for uuid={call_uuid}", flush=True)
-    return JSONResponse(content=ncco)
+    logger.info("[TTS_NCCO] Serving NCCO for uuid=%s", call_uuid)
+    return [{"action": "talk", "text": text, "bargeIn": True, "language": "en-US"}]
 
 @app.post("/voice/events")
 async def events(request: Request):
@@ -80,83 +134,72 @@ async def events(request: Request):
 
 @app.get("/voice/answer")
 async def answer(request: Request):
-    print(f" >>> [DEBUG] ENTERING handle_voice_answer", flush=True)
+    logger.debug("[ANSWER] Entering handle_voice_answer")
     return await handle_voice_answer(call_state, request)
 
 # --- WEBSOCKET STREAMING ---
-from fastapi import WebSocket
-from .groq import DeepgramStreamer, agent_response
-from .voice import inject_vonage_tts
-import asyncio
-import json
+from .groq import DeepgramStreamer, agent_response, warm_up
 
-# Store active websocket for sending TTS back
-_active_websocket = None
-_processing_ai = False
-_main_loop = None
-_current_call_uuid = None
+@dataclass
+class ConnCtx:
+    """Per-connection state for one /voice/stream websocket (one call)."""
+    websocket: WebSocket
+    loop: asyncio.AbstractEventLoop
+    uuid: Optional[str] = None
+    # Held while a turn is being answered; acquire(blocking=False) is an atomic
+    # test-and-set, so two end-of-speech events can never both start a turn
+    # whichever thread the streamer fires them from
+    turn_lock: threading.Lock = field(default_factory=threading.Lock)
+
+# 20 ms PCM frames per Deepgram send (3 = 60 ms of audio)
+_AUDIO_BATCH_FRAMES = 3
+
+def _schedule(loop, coro):
+    """Start `coro` as a background task on `loop` from any thread (no cross-thread Future)."""
+    loop.call_soon_threadsafe(spawn, coro)
 
 @app.websocket("/voice/stream")
 async def voice_stream(websocket: WebSocket):
-    global _active_websocket, _conversation_history, _processing_ai, _main_loop, _current_call_uuid
-    
     await websocket.accept()
-    print(" [WS] Client Connected")
+    logger.info("[WS] Client Connected")
     
-    _active_websocket = websocket
-    _processing_ai = False
-    _current_call_uuid = None
+    # State for this call only - concurrent calls each get their own
+    ctx = ConnCtx(websocket=websocket, loop=asyncio.get_running_loop())
     
-    # Capture the running event loop
-    _main_loop = asyncio.get_running_loop()
-    
-    # Connect Deepgram FIRST
-    streamer = DeepgramStreamer()
-    if not streamer.connect():
-        print(" [WS] Failed to connect to Deepgram")
+    # Connect Deepgram FIRST (Groq was already warmed by /voice/answer)
+    streamer = DeepgramStreamer(loop=ctx.loop)
+    if not await warm_up(streamer, groq=False):
+        logger.warning("[WS] Failed to connect to Deepgram")
         await websocket.close()
         return
     
-    # Set up speech ended callback
+    # Set up speech ended callback (dispatched onto this loop by the streamer)
     def on_speech_ended(transcript: str):
-        global _processing_ai, _main_loop, _current_call_uuid
-        if _processing_ai:
-            print(" [TURN] AI already processing, queuing...", flush=True)
+        if not ctx.turn_lock.acquire(blocking=False):
+            logger.info("[TURN] AI already processing, queuing...")
             return
         
-        print(f" [TURN] Processing user input: '{transcript}'", flush=True)
-        _processing_ai = True
+        logger.info("[TURN] Processing user input: '%s'", transcript)
         
         # Schedule AI processing
         try:
-            if _main_loop and _main_loop.is_running():
-                asyncio.run_coroutine_threadsafe(
-                    process_and_respond(transcript, websocket, _current_call_uuid),
-                    _main_loop
-                )
-            else:
-                print(" [TURN] No main loop available", flush=True)
-                _processing_ai = False
+            spawn(process_and_respond(transcript, ctx))
         except Exception as e:
-            print(f" [TURN] Failed to schedule AI: {e}", flush=True)
-            _processing_ai = False
+            logger.warning("[TURN] Failed to schedule AI: %s", e)
+            ctx.turn_lock.release()
     
     streamer.set_speech_ended_callback(on_speech_ended)
 
     # Set up barge-in (interruption) callback
     def on_barge_in():
-        global _current_call_uuid, _main_loop
-        if _current_call_uuid and _main_loop:
+        if ctx.uuid:
             # Check if barge-in makes sense (only if bot might be speaking)
             # We don't have a strict 'is_speaking' flag but stop_vonage_tts is safe to call
             # as it returns 404 if nothing is playing.
-            call_data = call_state.calls.get(_current_call_uuid, {})
+            call_data = call_state.calls.get(ctx.uuid, {})
             region_url = call_data.get("region_url")
             
-            asyncio.run_coroutine_threadsafe(
-                stop_vonage_tts(_current_call_uuid, region_url),
-                _main_loop
-            )
+            _schedule(ctx.loop, stop_vonage_tts(ctx.uuid, region_url))
             # Give Vonage regional endpoint a tiny moment to process the stop
             # before we potentially start any new logic.
 
@@ -164,49 +207,117 @@ async def voice_stream(websocket: WebSocket):
     
     try:
         packet_count = 0
-        while True:
+        # 1. Handshake: read frames until Vonage's JSON metadata gives us the call UUID
+        while ctx.uuid is None:
             message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
             
-            if "text" in message:
-                # Metadata / Handshake - Capture UUID
+            text = message.get("text")
+            if text and text.startswith("{"):
+                # Metadata / Handshake - Capture UUID (Vonage sends JSON objects only)
                 try:
-                    data = json.loads(message["text"])
-                    # Check root or headers for UUID
-                    possible_uuid = data.get("uuid") or data.get("headers", {}).get("uuid")
-                    if possible_uuid:
-                        _current_call_uuid = possible_uuid
-                        print(f" [WS] Call UUID captured: {_current_call_uuid}", flush=True)
-                except:
-                    pass
+                    data = orjson.loads(text)
+                except orjson.JSONDecodeError:
+                    data = {}
+                # Check root or headers for UUID
+                possible_uuid = data.get("uuid") or (data.get("headers") or {}).get("uuid")
+                if possible_uuid:
+                    ctx.uuid = possible_uuid
+                    logger.info("[WS] Call UUID captured: %s", ctx.uuid)
             
-            if "bytes" in message:
+            chunk = message.get("bytes")
+            if chunk:
                 packet_count += 1
-                if packet_count % 100 == 0:
-                    print(f" [WS] Recv {packet_count} packets", flush=True)
-                await streamer.send_audio(message["bytes"])
+                await streamer.send_audio(chunk)
+        
+        # 2. Audio: binary PCM frames, coalesced so Deepgram gets one send
+        #    per _AUDIO_BATCH_FRAMES frames
+        frames = []
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            chunk = message.get("bytes")
+            if not isinstance(chunk, bytes) or not chunk:
+                continue  # Text frame (JSON control message, DTMF, ...)
+            packet_count += 1
+            if packet_count % 100 == 0 and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[WS] Recv %s packets", packet_count)
+            frames.append(chunk)
+            if len(frames) >= _AUDIO_BATCH_FRAMES:
+                await streamer.send_audio(b"".join(frames))
+                frames.clear()
                 
     except Exception as e:
-        print(f" [WS] Error/Disconnect: {e}")
+        logger.warning("[WS] Error/Disconnect: %s", e)
     finally:
         streamer.close()
-        _active_websocket = None
-        print(" [WS] Closed")
+        logger.info("[WS] Closed")
 
 
-async def execute_ai_actions(call_uuid: str, all_tags: List, current_call_state: Dict, region_url: str = None, text_len: int = 0):
-    """Executes AI actions (CRM updates, transfers) in the background."""
+async def _transfer(call_uuid: str, current_call_state: Dict, region_url: str = None):
+    bot_num = current_call_state.get("bot_number", "18335645478")
+    await transfer_to_agent(call_uuid, AGENT_NUMBER, bot_num, region_url)
+
+async def _hangup(call_uuid: str, region_url: str = None, text_len: int = 0, last_tts: asyncio.Task = None):
+    # Wait for TTS to finish. ~12 chars per second approx, timed from when the
+    # last talk request went out (Vonage sends no talk-completed event).
+    delay = (text_len / 12.0) + 1.2 # Add buffer
+    delay = min(delay, 20.0) # Cap at 20s
+    if last_tts:
+        await last_tts
+    logger.info("[ACTION] Delaying hangup by %.2fs for TTS completion (text_len=%s)", delay, text_len)
+    arm_hangup_after_talk(call_uuid, region_url, delay)
+
+async def _create_ticket(call_uuid: str, current_call_state: Dict, desc: str):
+    contact_phone = current_call_state.get("from")
+    contact_id = current_call_state.get("contact_id")
+    sentiment = current_call_state.get("sentiment", "Neutral")
+    ticket_id = await create_ticket(call_uuid, desc, contact_phone, sentiment, requester_id=contact_id)
+    if ticket_id:
+        current_call_state["ticket_id"] = ticket_id
+
+async def _resolve_ticket(current_call_state: Dict, t_id: str = None):
+    t_id = t_id or current_call_state.get("ticket_id")
+    if t_id:
+        await update_ticket_status(int(t_id), 4) # 4 = Resolved
+
+async def _update_name(current_call_state: Dict, new_name: str):
+    contact_id = current_call_state.get("contact_id")
+    contact_phone = current_call_state.get("from")
+    
+    if contact_id:
+        await update_contact_name(contact_id, new_name)
+    elif contact_phone:
+        new_contact = await create_contact(new_name, contact_phone)
+        if new_contact:
+            current_call_state["contact_id"] = new_contact.get("id")
+    
+    current_call_state["contact_name"] = new_name
+
+async def _run_in_order(steps: List):
+    """Await each zero-argument coroutine factory in `steps` one after another."""
+    for step in steps:
+        await step()
+
+async def execute_ai_actions(call_uuid: str, all_tags: List, current_call_state: Dict, region_url: str = None, text_len: int = 0, last_tts: asyncio.Task = None):
+    """Executes AI actions (CRM updates, transfers) in the background.
+
+    Actions with a data dependency run in order: name/contact updates before
+    ticket creation (which needs the contact_id), and resolving the active
+    ticket after creating it. TRANSFER/HANGUP keep their relative order.
+    Each of those chains, and every independent action, runs concurrently.
+    """
     try:
-        from .voice import transfer_to_agent
-        from .freshdesk import create_ticket, update_ticket_status, update_contact_name, create_contact
-        
+        contact_steps, ticket_steps, call_steps, independent = [], [], [], []
         for tag_type, tag_content in all_tags:
-            print(f" [{tag_type}] Processing: {tag_content}", flush=True)
+            logger.debug("[%s] Processing: %s", tag_type, tag_content)
             
             if tag_type == "SENTIMENT":
                 sentiment = tag_content.strip().capitalize()
-                print(f" [ANALYSIS] User sentiment: {sentiment}", flush=True)
+                logger.info("[ANALYSIS] User sentiment: %s", sentiment)
                 current_call_state["sentiment"] = sentiment
-                await call_state.set_call_state(call_uuid, current_call_state)
                 continue
 
             # Original Action Logic
@@ -214,85 +325,67 @@ async def execute_ai_actions(call_uuid: str, all_tags: List, current_call_state:
             cmd = parts[0].upper()
             
             if cmd == "TRANSFER":
-                dest = os.getenv("AGENT_NUMBER", "18335645478")
-                bot_num = current_call_state.get("bot_number", "18335645478")
                 # Transfers MUST remain blocking or we might lose the turn context
-                await transfer_to_agent(call_uuid, dest, bot_num, region_url)
+                call_steps.append(partial(_transfer, call_uuid, current_call_state, region_url))
                 
             elif cmd == "CREATE_TICKET":
                 desc = parts[1] if len(parts) > 1 else "No description provided"
-                contact_phone = current_call_state.get("from")
-                contact_id = current_call_state.get("contact_id")
-                sentiment = current_call_state.get("sentiment", "Neutral")
-                ticket_id = await create_ticket(call_uuid, desc, contact_phone, sentiment, requester_id=contact_id)
-                if ticket_id:
-                    current_call_state["ticket_id"] = ticket_id
-                    await call_state.set_call_state(call_uuid, current_call_state)
+                ticket_steps.append(partial(_create_ticket, call_uuid, current_call_state, desc))
                     
             elif cmd == "RESOLVE_TICKET":
-                t_id = parts[1] if len(parts) > 1 else current_call_state.get("ticket_id")
-                if t_id:
-                    await update_ticket_status(int(t_id), 4) # 4 = Resolved
+                if len(parts) > 1:
+                    independent.append(partial(_resolve_ticket, current_call_state, parts[1]))
+                else:
+                    # Active ticket may be the one created in this same reply
+                    ticket_steps.append(partial(_resolve_ticket, current_call_state))
                     
             elif cmd == "UPDATE_NAME":
                 new_name = parts[1] if len(parts) > 1 else "Unknown"
-                contact_id = current_call_state.get("contact_id")
-                contact_phone = current_call_state.get("from")
-                
-                if contact_id:
-                    await update_contact_name(contact_id, new_name)
-                elif contact_phone:
-                    new_contact = await create_contact(new_name, contact_phone)
-                    if new_contact:
-                        current_call_state["contact_id"] = new_contact.get("id")
-                
-                current_call_state["contact_name"] = new_name
-                await call_state.set_call_state(call_uuid, current_call_state)
+                contact_steps.append(partial(_update_name, current_call_state, new_name))
             
             elif cmd == "USE_TICKET":
                 t_id = parts[1] if len(parts) > 1 else None
                 if t_id:
-                    print(f" [ACTION] User confirmed Ticket #{t_id}", flush=True)
+                    logger.info("[ACTION] User confirmed Ticket #%s", t_id)
                     current_call_state["ticket_id"] = t_id
-                    await call_state.set_call_state(call_uuid, current_call_state)
 
             elif cmd == "HANGUP":
-                # Wait for TTS to finish. ~12 chars per second approx.
-                delay = (text_len / 12.0) + 1.2 # Add buffer
-                delay = min(delay, 20.0) # Cap at 20s
-                print(f" [ACTION] Delaying hangup by {delay:.2f}s for TTS completion (text_len={text_len})", flush=True)
-                await asyncio.sleep(delay)
-                from .voice import hangup_call
-                await hangup_call(call_uuid, region_url)
+                call_steps.append(partial(_hangup, call_uuid, region_url, text_len, last_tts))
+
+        coros = [_run_in_order(steps) for steps in (contact_steps + ticket_steps, call_steps) if steps]
+        coros.extend(step() for step in independent)
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("[ACTION] Background action failed: %s", result, exc_info=result)
 
     except Exception as e:
-        print(f" [ACTION] Background execution error: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception("[ACTION] Background execution error: %s", e)
 
-async def process_and_respond(transcript: str, websocket: WebSocket, call_uuid: str):
-    """Process user speech with AI and respond using Vonage TTS."""
-    global _processing_ai
+async def process_and_respond(transcript: str, ctx: ConnCtx):
+    """Process user speech with AI and respond using Vonage TTS. Releases `ctx.turn_lock` when done."""
+    call_uuid = ctx.uuid
     start_total = time.perf_counter()
     
     try:
         if not call_uuid:
-            print(" [AI] Cannot process: No Call UUID", flush=True)
+            logger.info("[AI] Cannot process: No Call UUID")
             return
 
-        print(f" [AI] Processing: '{transcript}'", flush=True)
+        logger.info("[AI] Processing: '%s'", transcript)
         
-        # 1. Update Persistent History (User Turn)
+        # 1. Retrieve current call state for context
         state_start = time.perf_counter()
-        await call_state.append_history(call_uuid, "user", transcript)
-        
-        # 2. Retrieve current call state for context
-        current_call_state = await call_state.get_call_state(call_uuid)
+        current_call_state = call_state.get_call_state(call_uuid)
         state_duration = time.perf_counter() - state_start
-        print(f" [LATENCY] State management took {state_duration:.3f}s", flush=True)
+        logger.debug("[LATENCY] State management took %.3fs", state_duration)
         
-        # 3. Get AI response with context
+        # 2. Persist the user turn (in-memory, no I/O)
+        call_state.append_history(call_uuid, "user", transcript)
+        
+        # 3. Generate AI response
         ai_start = time.perf_counter()
-        from .groq import agent_response
+        region_url = current_call_state.get("region_url")
         ai_reply = await agent_response(
             issue=transcript,
             kb="",
@@ -303,51 +396,39 @@ async def process_and_respond(transcript: str, websocket: WebSocket, call_uuid:
             phone=current_call_state.get("phone")
         )
         ai_duration = time.perf_counter() - ai_start
-        print(f" [LATENCY] AI generation (agent_response) took {ai_duration:.3f}s", flush=True)
-        
-        # 4. Update Persistent History (Assistant Turn)
-        await call_state.append_history(call_uuid, "assistant", ai_reply)
+        logger.debug("[LATENCY] AI generation (agent_response) took %.3fs", ai_duration)
         
-        # 5. Parse Actions & Sentiment
-        parse_start = time.perf_counter()
-        all_tags = re.findall(r'\[(ACTION|SENTIMENT):\s*([^\]]+)\]', ai_reply)
+        # Collect Actions & Sentiment and strip them before speaking
+        all_tags, clean_speech = _split_tags(ai_reply)
         
-        # 6. Clean AI response for TTS (Strip all tags)
-        clean_speech = re.sub(r'\[(ACTION|SENTIMENT):[^\]]+\]', '', ai_reply).strip()
-        parse_duration = time.perf_counter() - parse_start
-        print(f" [LATENCY] Parse & Clean took {parse_duration:.3f}s", flush=True)
+        # 4. Speak the reply as one talk (not awaited - frees the turn). A second
+        # PUT /talk would replace one still playing, and Vonage sends no event
+        # when a talk finishes, so sentences can't be queued safely.
+        last_tts = None
+        if clean_speech:
+            logger.debug("[TTS] Injecting Vonage TTS (Clean): '%s...'", clean_speech[:50])
+            last_tts = spawn(inject_vonage_tts(call_uuid, clean_speech, region_url))
         
-        # 7. Start TTS Injection immediately (PRIORITY 1)
-        tts_start = time.perf_counter()
-        region_url = current_call_state.get("region_url")
-        if call_uuid:
-            print(f" [TTS] Injecting Vonage TTS (Clean): '{clean_speech[:50]}...'", flush=True)
-            # Fire TTS immediately. We await it since it's the bridge to the user.
-            await inject_vonage_tts(call_uuid, clean_speech, region_url)
-        else:
-            print(" [TTS] No UUID captured, cannot use Vonage TTS", flush=True)
-        tts_final_duration = time.perf_counter() - tts_start
-        print(f" [LATENCY] Total TTS step took {tts_final_duration:.3f}s", flush=True)
+        # 5. Update Persistent History (Assistant Turn)
+        call_state.append_history(call_uuid, "assistant", ai_reply)
         
         total_duration = time.perf_counter() - start_total
-        print(f" [LATENCY] TOTAL PIPELINE TIME: {total_duration:.3f}s", flush=True)
+        logger.info("[LATENCY] TOTAL PIPELINE TIME: %.3fs", total_duration)
 
-        # 8. Offload CRM/Actions to BACKGROUND (PRIORITY 2)
+        # 6. Offload CRM/Actions to BACKGROUND (PRIORITY 2)
         if all_tags:
-            import asyncio
-            asyncio.create_task(execute_ai_actions(call_uuid, all_tags, current_call_state, region_url, text_len=len(clean_speech)))
+            spawn(execute_ai_actions(call_uuid, all_tags, current_call_state, region_url, text_len=len(clean_speech), last_tts=last_tts))
         
     except Exception as e:
-        print(f" [AI] Error: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        logger.exception("[AI] Error: %s", e)
     finally:
-        _processing_ai = False
-        print(f" [TURN] Ready for next input", flush=True)
+        ctx.turn_lock.release()
+        logger.debug("[TURN] Ready for next input")
 
 if __name__ == "__main__":
     import uvicorn
     print("\n" + "="*50, flush=True)
     print("  SANDEZA VOICE AI DEBUG ", flush=True)
     print("="*50 + "\n", flush=True)
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # "auto" runs on uvloop when it is installed (not on Windows), as the uvicorn CLI does
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True, loop="auto")
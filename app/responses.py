@@ -0,0 +1,11 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (used as the app's default response class)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+# In-flight fetches by key, so concurrent identical requests share one network call.
+# Callers namespace their keys ("contact:", "kb:", "combined_kb:", ...).
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class _LeaderCancelled(Exception):
+    """The caller running a shared fetch was cancelled; its waiters retry."""
+
+
+async def single_flight(key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+    """Run `fetch()` once per key; concurrent callers await the same result.
+
+    If the caller running the fetch is cancelled (a deadline, a hung-up call),
+    the others don't inherit that cancellation: the first one to wake starts
+    the fetch again and the rest wait on it.
+    """
+    while (fut := _inflight.get(key)) is not None:
+        try:
+            return await asyncio.shield(fut)
+        except _LeaderCancelled:
+            continue
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await fetch()
+        fut.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        fut.set_exception(_LeaderCancelled())
+        fut.exception()  # mark retrieved in case nobody was waiting
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved so an unawaited future doesn't warn
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -1,14 +1,26 @@
+import asyncio
+from collections import deque
 from typing import Dict, Any, List
 from datetime import datetime, timedelta
 
+HISTORY_MAXLEN = 50  # Keep last 50 messages for ticket sync
+
+def new_history() -> deque:
+    """Bounded turn history: appends are O(1) and old turns drop off automatically."""
+    return deque(maxlen=HISTORY_MAXLEN)
+
 class ConversationState:
     def __init__(self):
         self.calls: Dict[str, Dict[str, Any]] = {}
+        # Set once the background Freshdesk lookup for a call has finished
+        self._lookup_events: Dict[str, asyncio.Event] = {}
     
-    async def get_call_state(self, call_uuid: str) -> Dict[str, Any]:
+    # Plain in-memory dict access: these are sync so callers don't pay a coroutine
+    # round-trip, and get_call_state hands back the live dict to mutate in place.
+    def get_call_state(self, call_uuid: str) -> Dict[str, Any]:
         if call_uuid not in self.calls:
             self.calls[call_uuid] = {
-                "history": [],
+                "history": new_history(),
                 "processing": False,
                 "ticket_id": None,
                 "phone": "",
@@ -19,11 +31,18 @@ class ConversationState:
             }
         return self.calls[call_uuid]
     
-    async def set_call_state(self, call_uuid: str, state: Dict[str, Any]):
+    def set_call_state(self, call_uuid: str, state: Dict[str, Any]):
         self.calls[call_uuid] = state
     
-    async def append_history(self, call_uuid: str, role: str, content: str):
-        state = await self.get_call_state(call_uuid)  # ✅ FIXED: get state first
+    def append_history(self, call_uuid: str, role: str, content: str):
+        state = self.get_call_state(call_uuid)  # ✅ FIXED: get state first
         state["history"].append({"role": role, "content": content})
-        state["history"] = state["history"][-50:] # Keep last 50 messages for ticket sync
-        await self.set_call_state(call_uuid, state)
+    
+    def get_lookup_event(self, call_uuid: str) -> asyncio.Event:
+        event = self._lookup_events.get(call_uuid)
+        if event is None:
+            event = self._lookup_events[call_uuid] = asyncio.Event()
+        return event
+    
+    def drop_lookup_event(self, call_uuid: str):
+        self._lookup_events.pop(call_uuid, None)
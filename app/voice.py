@@ -1,21 +1,25 @@
 from fastapi import Request
-from fastapi.responses import JSONResponse
 import os
 import httpx
 import base64
 import re
 import time
 import asyncio
-import traceback
+import logging
+from functools import partial
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
 import vonage
+from cachetools import TTLCache
+from selectolax.lexbor import LexborHTMLParser
 
 # App-specific imports
-from .groq import agent_response, transcribe_deep
-from .state import ConversationState
-from .freshdesk import search_contact_by_phone, get_latest_tickets, create_ticket, update_ticket_status, update_contact_name, add_ticket_note, create_contact
+from .groq import agent_response, transcribe_deep, warm_up
+from .state import ConversationState, new_history
+from .responses import ORJSONResponse
+from .freshdesk import fetch_all, create_ticket, update_ticket_status, update_contact_name, add_ticket_note, create_contact
+from .singleflight import single_flight
 
 # Look for .env in current dir and /app subdir
 load_dotenv()
@@ -27,17 +31,41 @@ AGENT_NUMBER = os.getenv("AGENT_NUMBER", "14702834062") # Default fallback
 VONAGE_APP_ID = os.getenv("VONAGE_APPLICATION_ID")
 VONAGE_PRIVATE_KEY_PATH = os.getenv("VONAGE_PRIVATE_KEY_PATH", "private.key")
 
+logger = logging.getLogger("app.voice")
+
+# Patterns used on every ASR turn / KB search, compiled once
+_RE_PUNCT = re.compile(r'[^\w\s]')
+_RE_NON_DIGIT = re.compile(r'\D')
+_RE_HTML_TAG = re.compile(r'<[^>]*>')
+# One alternation for every action tag the LLM can emit, scanned once per reply
+_RE_ACTION_TAGS = re.compile(r'\[(?:SENTIMENT:\s*(?P<sent>[^\]]*)|ACTION:\s*(?P<act>CREATE_TICKET|USE_TICKET|RESOLVE_TICKET|UPDATE_NAME|TRANSFER|HANGUP|WAIT)(?::\s*(?P<arg>[^\]]*))?)\]')
+# Any tag, known or not, is scrubbed from the spoken text
+_RE_TAG_SCRUB = re.compile(r'\[(ACTION|SENTIMENT):[^\]]*\]')
+# Actions ignored without an argument (a ticket with no description, an empty name)
+_ACTIONS_NEEDING_ARG = ("CREATE_TICKET", "UPDATE_NAME")
+
 import urllib.parse
 import json
-import jwt
+import orjson
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 # Caching for Performance
 _VONAGE_PRIVATE_KEY = None
+# Set once the key path search has run, so a missing key isn't searched for again
+_VONAGE_KEY_RESOLVED = False
 _SHARED_HTTP_CLIENT = None
+# jti_prefix -> (token, exp); tokens are reused until close to expiry
+_JWT_CACHE: Dict[str, tuple] = {}
+_JWT_TTL = 55
+_JWT_MIN_REMAINING = 15
 
 def _get_vonage_private_key():
-    global _VONAGE_PRIVATE_KEY
-    if _VONAGE_PRIVATE_KEY is None:
+    """Load and parse the Vonage private key once; returns the cryptography key object (or None)."""
+    global _VONAGE_PRIVATE_KEY, _VONAGE_KEY_RESOLVED
+    if not _VONAGE_KEY_RESOLVED:
+        _VONAGE_KEY_RESOLVED = True
         # Strategy: Try configured path, then app subfolder, then root
         paths_to_try = [
             VONAGE_PRIVATE_KEY_PATH,
@@ -49,167 +77,202 @@ def _get_vonage_private_key():
         for p in paths_to_try:
             if p and os.path.exists(p):
                 try:
-                    with open(p, 'r') as key_file:
-                        _VONAGE_PRIVATE_KEY = key_file.read()
-                        print(f" [VONAGE] Private key loaded from: {p}", flush=True)
+                    with open(p, 'rb') as key_file:
+                        # Parse the PEM here so signing gets a ready key object
+                        _VONAGE_PRIVATE_KEY = load_pem_private_key(key_file.read(), password=None)
+                        logger.info("[VONAGE] Private key loaded from: %s", p)
                         break
                 except Exception as e:
-                    print(f" [VONAGE] Failed to read private key at {p}: {e}", flush=True)
+                    logger.warning("[VONAGE] Failed to read private key at %s: %s", p, e)
         
         if _VONAGE_PRIVATE_KEY is None:
-            print(f" [VONAGE] CRITICAL: Private key not found in any standard location!", flush=True)
+            logger.error("[VONAGE] CRITICAL: Private key not found in any standard location!")
             
     return _VONAGE_PRIVATE_KEY
 
+# Resolve the key at import so the path search runs once per process
+_get_vonage_private_key()
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+# JOSE header never changes, so it is encoded once
+_JWT_HEADER_B64 = _b64url(b'{"alg":"RS256","typ":"JWT"}')
+
+def _sign_rs256(claims: Dict[str, Any], private_key) -> str:
+    """Mint an RS256 JWT by signing header.payload directly with the cryptography key."""
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url(orjson.dumps(claims))
+    signature = private_key.sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
+    return (signing_input + b"." + _b64url(signature)).decode("ascii")
+
 def _generate_vonage_jwt(jti_prefix: str = "jwt"):
-    """Internal helper to generate a Vonage JWT."""
+    """Internal helper to generate a Vonage JWT.
+
+    Signed tokens are cached per `jti_prefix` and reused while they have more than
+    _JWT_MIN_REMAINING seconds left, so most Vonage calls skip the RSA sign.
+    """
+    now = int(time.time())
+    cached = _JWT_CACHE.get(jti_prefix)
+    if cached and cached[1] - now > _JWT_MIN_REMAINING:
+        return cached[0]
+    
     private_key = _get_vonage_private_key()
     if not private_key:
         return None
     
-    now = int(time.time())
+    exp = now + _JWT_TTL
     claims = {
         "application_id": VONAGE_APP_ID,
         "iat": now,
-        "exp": now + 60,
+        "exp": exp,
         "jti": f"{jti_prefix}_{now}"
     }
-    return jwt.encode(claims, private_key, algorithm='RS256')
+    token = _sign_rs256(claims, private_key)
+    _JWT_CACHE[jti_prefix] = (token, exp)
+    return token
+
+# Vonage request bodies: static parts encoded once, variable fields filled in with orjson
+_TALK_BODY_FMT = b'{"text":%s,"language":"en-US"}'
+_HANGUP_BODY = b'{"action":"hangup"}'
+_TRANSFER_BODY_FMT = (
+    b'{"action":"transfer","destination":{"type":"ncco","ncco":[{"action":"connect","from":%s,'
+    b'"endpoint":[{"type":"phone","number":%s}]}]}}'
+)
+
+# Per-endpoint request timeouts (seconds) for the shared client
+HTTP_TIMEOUTS = {
+    "default": httpx.Timeout(30.0, connect=10.0),
+    "kb": 1.5,
+    "transfer": 10.0,
+}
 
 def _get_http_client():
     global _SHARED_HTTP_CLIENT
     if _SHARED_HTTP_CLIENT is None or _SHARED_HTTP_CLIENT.is_closed:
-        _SHARED_HTTP_CLIENT = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+        _SHARED_HTTP_CLIENT = httpx.AsyncClient(
+            http2=True,  # multiplex inject/stop/hangup/transfer over one connection per region
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60.0),
+            timeout=HTTP_TIMEOUTS["default"]
+        )
     return _SHARED_HTTP_CLIENT
 
+async def aclose():
+    """Close the shared Vonage/KB client (called on app shutdown)."""
+    global _SHARED_HTTP_CLIENT
+    if _SHARED_HTTP_CLIENT is not None and not _SHARED_HTTP_CLIENT.is_closed:
+        await _SHARED_HTTP_CLIENT.aclose()
+    _SHARED_HTTP_CLIENT = None
+
+# Strong references to fire-and-forget tasks (the event loop only keeps weak ones)
+_BG_TASKS: set = set()
+
+def spawn(coro) -> asyncio.Task:
+    """create_task for work nobody awaits: keeps the task alive until it finishes."""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+    return task
+
+async def _vonage_request(method: str, call_uuid: str, path: str, region_url: str, jti_prefix: str, body: bytes = None, **kwargs):
+    """
+    Authenticated request to {region}/v1/calls/{call_uuid}{path} on the shared client.
+    region_url typically comes as 'https://api-us-3.vonage.com' from webhooks; falls back to api.nexmo.com.
+    Returns the response, or None if no JWT could be minted.
+    """
+    base_url = region_url if region_url else "https://api.nexmo.com"
+    token = _generate_vonage_jwt(jti_prefix)
+    if not token:
+        return None
+    
+    headers = {"Authorization": f"Bearer {token}"}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    url = f"{base_url}/v1/calls/{call_uuid}{path}"
+    logger.debug("[VONAGE] HTTP %s %s", method, url)
+    return await _get_http_client().request(method, url, content=body, headers=headers, **kwargs)
+
 async def inject_vonage_tts(call_uuid: str, text: str, region_url: str = None):
     """
     Inject TTS into live call using Vonage REST API (Play TTS / Talk endpoint).
     Uses raw HTTP to bypass SDK 'api_host' configuration limitations and ensure proper Regional Endpoint targeting.
     """
-    print(f" [VONAGE] Injecting TTS via play_tts_into_call (Raw HTTP): '{text[:50]}...'", flush=True)
+    logger.info("[VONAGE] Injecting TTS via play_tts_into_call (Raw HTTP): '%s...'", text[:50])
     
     try:
-        # 1. Determine correct endpoint (Regional or Global)
         if not region_url:
-            print(" [VONAGE] Warning: No region_url provided, defaulting to api.nexmo.com")
-            base_url = "https://api.nexmo.com"
-        else:
-            # region_url typically comes as 'https://api-us-3.vonage.com' from webhooks
-            base_url = region_url
-            
-        url = f"{base_url}/v1/calls/{call_uuid}/talk"
+            logger.warning("[VONAGE] Warning: No region_url provided, defaulting to api.nexmo.com")
         
-        # 2. Construct Payload
         # Docs: https://developer.vonage.com/en/api/voice#startTalk
         # REMOVED voice_name to avoid conflict with language
-        payload = {
-            "text": text,
-            "language": "en-US"
-        }
-        
-        # 3. Generate JWT
-        token = _generate_vonage_jwt("talk")
-        if not token:
-            return
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        body = _TALK_BODY_FMT % orjson.dumps(text)
         
-        # 4. Send Request
-        http_client = _get_http_client()
-        print(f" [VONAGE] HTTP PUT {url}", flush=True)
         start_tts = time.perf_counter()
-        resp = await http_client.put(url, json=payload, headers=headers)
+        resp = await _vonage_request("PUT", call_uuid, "/talk", region_url, "talk", body)
         tts_duration = time.perf_counter() - start_tts
+        if resp is None:
+            return
             
         if resp.status_code == 200:
-            print(f" [VONAGE] TTS Injection Success: 200 OK - {resp.json()}", flush=True)
-            print(f" [LATENCY] Vonage TTS Injection (Network) took {tts_duration:.3f}s", flush=True)
+            logger.info("[VONAGE] TTS Injection Success: status=%s", resp.status_code)
+            logger.debug("[LATENCY] Vonage TTS Injection (Network) took %.3fs", tts_duration)
         else:
-            print(f" [VONAGE] Injection Failed: {resp.status_code} - {resp.text}", flush=True)
+            logger.warning("[VONAGE] Injection Failed: %s - %s", resp.status_code, resp.text)
 
     except Exception as e:
-        print(f" [VONAGE] Raw Injection Error: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception("[VONAGE] Raw Injection Error: %s", e)
 
 async def stop_vonage_tts(call_uuid: str, region_url: str = None):
     """
     Stops any ongoing TTS playback for the given call leg.
     This is used to implement manual barge-in.
     """
-    print(f" [VONAGE] Stopping TTS for {call_uuid}...", flush=True)
+    logger.info("[VONAGE] Stopping TTS for %s...", call_uuid)
     
     try:
-        base_url = region_url if region_url else "https://api.nexmo.com"
-        url = f"{base_url}/v1/calls/{call_uuid}/talk"
-        
-        # 1. Generate JWT
-        private_key = _get_vonage_private_key()
-        if not private_key:
+        resp = await _vonage_request("DELETE", call_uuid, "/talk", region_url, "stop")
+        if resp is None:
             return
-            
-        now = int(time.time())
-        claims = {
-            "application_id": VONAGE_APP_ID,
-            "iat": now,
-            "exp": now + 60,
-            "jti": f"stop_{now}"
-        }
-        token = jwt.encode(claims, private_key, algorithm='RS256')
-        
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        http_client = _get_http_client()
-        print(f" [VONAGE] HTTP DELETE {url}", flush=True)
-        resp = await http_client.delete(url, headers=headers)
         if resp.status_code in (200, 204):
-            print(f" [VONAGE] TTS Stopped Successfully", flush=True)
+            logger.info("[VONAGE] TTS Stopped Successfully")
         else:
-                # 404 might mean no TTS was playing, which is fine
-            print(f" [VONAGE] Stop Result: {resp.status_code}", flush=True)
+            # 404 might mean no TTS was playing, which is fine
+            logger.info("[VONAGE] Stop Result: %s", resp.status_code)
 
     except Exception as e:
-        print(f" [VONAGE] Stop Error: {e}", flush=True)
+        logger.error("[VONAGE] Stop Error: %s", e)
 
 async def hangup_call(call_uuid: str, region_url: str = None):
     """
     Terminates a call programmatically via Vonage REST API.
     """
-    print(f" [VONAGE] Hanging up call {call_uuid}...", flush=True)
+    logger.info("[VONAGE] Hanging up call %s...", call_uuid)
     try:
-        base_url = region_url if region_url else "https://api.nexmo.com"
-        url = f"{base_url}/v1/calls/{call_uuid}"
-        
-        payload = {"action": "hangup"}
-        token = _generate_vonage_jwt("hangup")
-        if not token:
+        resp = await _vonage_request("PUT", call_uuid, "", region_url, "hangup", _HANGUP_BODY)
+        if resp is None:
             return
-            
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        client = _get_http_client()
-        resp = await client.put(url, json=payload, headers=headers)
         
         if resp.status_code == 200:
-            print(f" [VONAGE] Call {call_uuid} hung up successfully.", flush=True)
+            logger.info("[VONAGE] Call %s hung up successfully.", call_uuid)
         else:
-            print(f" [VONAGE] Hangup Result: {resp.status_code} {resp.text}", flush=True)
+            logger.info("[VONAGE] Hangup Result: %s %s", resp.status_code, resp.text)
             
     except Exception as e:
-        print(f" [VONAGE] Hangup Error: {e}", flush=True)
+        logger.error("[VONAGE] Hangup Error: %s", e)
+
+def arm_hangup_after_talk(call_uuid: str, region_url: str = None, delay_s: float = 20.0):
+    """
+    Hang up `delay_s` seconds from now, once the last talk has had time to play.
+    Vonage sends no completion event for talks started via PUT /talk (the response
+    only carries the call UUID), so an estimated timer is the only signal we have.
+    """
+    asyncio.get_running_loop().call_later(delay_s, lambda: spawn(hangup_call(call_uuid, region_url)))
 
 async def transfer_call_via_api(call_uuid: str, destination_number: str):
     """
     Transfers a live call using the Vonage Voice Method (Modifying the call).
     This equates to: curl -X PUT https://api.nexmo.com/v1/calls/{uuid} ...
     """
-    print(f" [API_TRANSFER] Attempting to transfer {call_uuid} to {destination_number}...")
+    logger.info("[API_TRANSFER] Attempting to transfer %s to %s...", call_uuid, destination_number)
     
     # NOTE: This requires generating a JWT. 
     # Since we don't have the 'vonage' lib imported, we will assume a helper or 
@@ -236,7 +299,7 @@ async def transfer_call_via_api(call_uuid: str, destination_number: str):
         }
     }
     
-    print(f" [API_TRANSFER] Payload: {payload}")
+    logger.debug("[API_TRANSFER] Payload: %s", payload)
     # To actually execute, we need a valid JWT.
     # headers = {"Authorization": f"Bearer {jwt_token}", "Content-Type": "application/json"}
     # async with httpx.AsyncClient() as client:
@@ -252,190 +315,194 @@ async def transfer_to_agent(call_uuid: str, agent_number: str, from_number: str,
     agent_number = agent_number if agent_number.startswith("+") else f"+{agent_number}"
     from_number = from_number if from_number.startswith("+") else f"+{from_number}"
     
-    print(f" [VONAGE] Transferring call {call_uuid} TO {agent_number} FROM {from_number}...", flush=True)
+    logger.info("[VONAGE] Transferring call %s TO %s FROM %s...", call_uuid, agent_number, from_number)
     
     try:
-        base_url = region_url if region_url else "https://api.nexmo.com"
-        url = f"{base_url}/v1/calls/{call_uuid}"
-        
-        # 1. Generate JWT
-        with open(VONAGE_PRIVATE_KEY_PATH, 'r') as key_file:
-            private_key = key_file.read()
-            
-        now = int(time.time())
-        claims = {
-            "application_id": VONAGE_APP_ID,
-            "iat": now,
-            "exp": now + 60,
-            "jti": f"agent_transfer_{now}"
-        }
-        token = jwt.encode(claims, private_key, algorithm='RS256')
+        # NCCO-based Transfer Payload
+        body = _TRANSFER_BODY_FMT % (orjson.dumps(from_number), orjson.dumps(agent_number))
         
-        # 2. Construct NCCO-based Transfer Payload
-        payload = {
-            "action": "transfer",
-            "destination": {
-                "type": "ncco",
-                "ncco": [
-                    {
-                        "action": "connect",
-                        "from": from_number,
-                        "endpoint": [
-                            {
-                                "type": "phone",
-                                "number": agent_number
-                            }
-                        ]
-                    }
-                ]
-            }
-        }
+        resp = await _vonage_request("PUT", call_uuid, "", region_url, "agent_transfer", body, timeout=HTTP_TIMEOUTS["transfer"])
+        if resp is None:
+            return False
         
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        # 3. Send Request
-        async with httpx.AsyncClient(timeout=10.0) as http_client:
-            print(f" [VONAGE] HTTP PUT {url} (Agent Transfer)", flush=True)
-            resp = await http_client.put(url, json=payload, headers=headers)
-            
-            if resp.status_code in (200, 204):
-                print(f" [VONAGE] Agent Transfer Initiated Successfully", flush=True)
-                return True
-            else:
-                print(f" [VONAGE] Agent Transfer Failed: {resp.status_code} - {resp.text}", flush=True)
-                return False
+        if resp.status_code in (200, 204):
+            logger.info("[VONAGE] Agent Transfer Initiated Successfully")
+            return True
+        else:
+            logger.warning("[VONAGE] Agent Transfer Failed: %s - %s", resp.status_code, resp.text)
+            return False
 
     except Exception as e:
-        print(f" [VONAGE] Agent Transfer Error: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception("[VONAGE] Agent Transfer Error: %s", e)
         return False
 
 
+# Caller phone -> Freshdesk contact id from earlier lookups (1 hour TTL), used to
+# prefetch a repeat caller's tickets while the live contact search runs
+_PHONE_TO_CONTACT_ID: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+
+# Hard budget for the contact + tickets lookup; matches how long the first
+# ASR turn waits for it
+LOOKUP_DEADLINE = 2.5
+
 async def background_freshdesk_lookup(state: ConversationState, call_uuid: str, from_number: str):
     """Perform Freshdesk lookup in background to reduce initial call latency."""
-    print(f" [BACKGROUND] Starting lookup for {from_number}...", flush=True)
+    logger.info("[BACKGROUND] Starting lookup for %s...", from_number)
     contact_name = None
     recent_tickets = []
     
     try:
-        contact = await search_contact_by_phone(from_number)
-        
-        # If no contact found, create a placeholder immediately
-        if not contact or not contact.get("id"):
-            print(f" [BACKGROUND] No contact found for {from_number}. Creating placeholder...", flush=True)
+        contact, recent_tickets = await fetch_all(from_number, LOOKUP_DEADLINE, _PHONE_TO_CONTACT_ID.get(from_number))
+        
+        if contact is None:
+            # Search didn't answer in time: unknown, not absent, so no placeholder
+            logger.warning("[BACKGROUND] Contact search for %s timed out; continuing anonymously", from_number)
+        elif not contact.get("id"):
+            # If no contact found, create a placeholder immediately (a new contact has no tickets)
+            logger.info("[BACKGROUND] No contact found for %s. Creating placeholder...", from_number)
             contact = await create_contact(name=from_number, phone=from_number)
         
         if contact and contact.get("id"):
             name = contact.get("name")
             # STRICTOR CHECK: Name MUST contain at least one letter [a-zA-Z]
             # If name is just numbers, phone-formatted, or "Unknown", treat as anonymous for AI grooming
-            is_valid_name = name and re.search(r'[a-zA-Z]', str(name)) and name.lower() != "unknown"
+            is_valid_name = name and any(c.isalpha() for c in str(name)) and name.lower() != "unknown"
             
             if not is_valid_name:
-                print(f" [BACKGROUND] Numeric or placeholder name detected '{name}'. Treating as anonymous.", flush=True)
+                logger.info("[BACKGROUND] Numeric or placeholder name detected '%s'. Treating as anonymous.", name)
                 contact_name = None # Set to None so AI prompt uses "Unknown"
             else:
                 contact_name = name
-                print(f" [BACKGROUND] Found valid contact: {contact_name}", flush=True)
+                logger.info("[BACKGROUND] Found valid contact: %s", contact_name)
             
-            recent_tickets = await get_latest_tickets(contact.get("id"))
+            _PHONE_TO_CONTACT_ID[from_number] = contact["id"]
             call_state_update = {
                 "contact_id": contact.get("id"),
                 "contact_name": contact_name,
                 "recent_tickets": recent_tickets
             }
     except Exception as e:
-        print(f" [BACKGROUND] Lookup error: {e}", flush=True)
+        logger.error("[BACKGROUND] Lookup error: %s", e)
 
     # Update state with found info
-    call_state = await state.get_call_state(call_uuid)
-    if call_state:
-        if 'call_state_update' in locals():
-            call_state.update(call_state_update)
-        call_state["lookup_done"] = True
-        await state.set_call_state(call_uuid, call_state)
-        print(f" [BACKGROUND] lookup sync complete for {call_uuid}", flush=True)
+    try:
+        call_state = state.get_call_state(call_uuid)
+        if call_state:
+            if 'call_state_update' in locals():
+                call_state.update(call_state_update)
+            call_state["lookup_done"] = True
+            state.set_call_state(call_uuid, call_state)
+            logger.info("[BACKGROUND] lookup sync complete for %s", call_uuid)
+    finally:
+        # Wake any ASR turn waiting on this lookup
+        state.get_lookup_event(call_uuid).set()
+
+# Combined solutions + community results keyed by search keywords (10 min TTL)
+_COMBINED_KB_CACHE: TTLCache = TTLCache(maxsize=512, ttl=600)
 
 async def fetch_combined_knowledge(query: str) -> str:
     if not query.strip():
         return ""
     
-    # words = re.sub(r'[^\w\s]', '', query.lower()).split()
-    # words = [w for w in words if len(w) > 2][:6]
-    # search_term = ' '.join(words)
+    # Keywords (same extraction as freshdesk.fetch_kb_context) are only the cache
+    # key, so paraphrases of one issue share an entry; the search uses the query
+    words = [w for w in _RE_PUNCT.sub('', query.lower()).split() if len(w) > 2][:6]
+    cache_key = ' '.join(words) or ' '.join(query.lower().split())[:128]
+    cached = _COMBINED_KB_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
     
-    # Reuse the refined logic from before
-    search_term = query # Or more sophisticated parsing
+    # Concurrent identical questions (same or parallel calls) share one search
+    return await single_flight(f"combined_kb:{cache_key}", lambda: _fetch_combined_knowledge(query, cache_key))
 
-    print(f" Searching KB for: '{search_term}'", flush=True)
-    
-    kb_snippets = []
+async def _fetch_combined_knowledge(query: str, cache_key: str) -> str:
+    logger.info("Searching KB for: '%s'", query)
     
-    async def fetch_solutions():
+    async def fetch_solutions() -> List[str]:
         try:
-            async with httpx.AsyncClient(timeout=1.5) as client:
-                resp = await client.get(
-                    f"https://{FRESH_DOMAIN}/support/search/solutions.json",
-                    params={'term': search_term}
-                )
-                data = resp.json()
-                articles = data.get('data', []) if isinstance(data, dict) else data
-                for art in articles[:2]:
-                    title = art.get('title', '')
-                    raw_desc = art.get('description') or art.get('description_text') or art.get('desc') or ""
-                    desc = re.sub(r'<[^>]*>', ' ', str(raw_desc)).strip()
-                    kb_snippets.append(f"ARTICLE: {title}\nSTEPS: {desc[:800]}")
+            client = _get_http_client()
+            resp = await client.get(
+                f"https://{FRESH_DOMAIN}/support/search/solutions.json",
+                params={'term': query},
+                timeout=HTTP_TIMEOUTS["kb"]
+            )
+            data = orjson.loads(resp.content)
+            articles = data.get('data', []) if isinstance(data, dict) else data
+            return [
+                f"ARTICLE: {art.get('title', '')}\nSTEPS: {_RE_HTML_TAG.sub(' ', str(art.get('description') or art.get('description_text') or art.get('desc') or '')).strip()[:800]}"
+                for art in articles[:2]
+            ]
         except Exception as e:
-            print(f"Solutions search failed: {e}")
+            logger.warning("Solutions search failed: %s", e)
+            return []
 
-    async def fetch_community_archives():
+    async def fetch_community_archives() -> List[str]:
         try:
-            # Archives search - faster timeout
-            url = f"https://community.freshworks.com/search?category=Using+Freshdesk+%3E+Archives+-+Freshdesk&q={search_term.replace(' ', '+')}"
-            async with httpx.AsyncClient(timeout=1.5) as client:
-                resp = await client.get(url)
-                html = resp.text
-                results = re.findall(r'<a[^>]*class="[^"]*forum-search-result__title[^"]*"[^>]*>(.*?)</a>.*?<div[^>]*class="[^"]*forum-search-result__content[^"]*"[^>]*>(.*?)</div>', html, re.DOTALL)
-                for title, content in results[:2]:
-                    title_clean = re.sub(r'<[^>]*>', '', title).strip()
-                    content_clean = re.sub(r'<[^>]*>', ' ', content).strip()
-                    kb_snippets.append(f"COMMUNITY ARCHIVE: {title_clean}\nSOLUTION: {content_clean[:800]}")
+            url = f"https://community.freshworks.com/search?category=Using+Freshdesk+%3E+Archives+-+Freshdesk&q={query.replace(' ', '+')}"
+            client = _get_http_client()
+            resp = await client.get(url, timeout=HTTP_TIMEOUTS["kb"])
+            tree = LexborHTMLParser(resp.text)
+            titles = tree.css(".forum-search-result__title")
+            contents = tree.css(".forum-search-result__content")
+            return [
+                f"COMMUNITY ARCHIVE: {title.text(separator=' ', strip=True)}\nSOLUTION: {content.text(separator=' ', strip=True)[:800]}"
+                for title, content in zip(titles[:2], contents[:2])
+            ]
         except Exception as e:
-            print(f"Community search failed: {e}")
+            logger.warning("Community search failed: %s", e)
+            return []
 
-    await asyncio.gather(fetch_solutions(), fetch_community_archives())
-    
+    # Joined in a fixed order (articles first) regardless of which search lands first
+    solutions, community = await asyncio.gather(fetch_solutions(), fetch_community_archives())
+    kb_snippets = solutions + community
     combined_text = "\n\n".join(kb_snippets)
-    print(f"CONTEXT READY: {len(kb_snippets)} sources.")
+    logger.info("CONTEXT READY: %s sources.", len(kb_snippets))
+    # Empty results are not cached so the next turn retries
+    if combined_text:
+        _COMBINED_KB_CACHE[cache_key] = combined_text
     return combined_text
 
 
+# ASR turn word lists (matched against the punctuation-stripped, lower-cased transcript)
+_ASR_ERROR_TAGS = frozenset({"[ASR_FAILED]", "[ASR_ERROR]", "[NO_AUDIO]"})
+_NOISE_ARTIFACTS = frozenset({"hau", "uh", "um", "the wind", "background noise", "[noise]", "disturbance"})
+# Common confirmation/greeting words allowed through even if short
+_SHORT_WORD_WHITELIST = frozenset({"yes", "no", "ok", "help", "yeah", "yep", "sure", "yup", "hi", "hey"})
+# Short/confirmation turns skip the KB search
+_CONFIRMATIONS = frozenset({"yes", "no", "okay", "ok", "yep", "sure", "correct", "perfect", "done", "completed"})
+
+# Max time an ASR turn waits for the KB search before calling the LLM
+KB_WAIT_BUDGET = 0.3
+
+def _stash_pending_kb(call_state: Dict[str, Any], task: asyncio.Task):
+    """Done-callback for a KB search that missed its turn: keep the result for the next one."""
+    if not task.cancelled() and task.exception() is None and task.result():
+        call_state["pending_kb"] = task.result()
+
 async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
     data = await request.json()
     call_uuid = data.get("uuid")
     
-    call_state = await state.get_call_state(call_uuid)
+    call_state = state.get_call_state(call_uuid)
     if not call_state:
-        return JSONResponse(content={"error": "No session"}, status_code=404)
+        return ORJSONResponse(content={"error": "No session"}, status_code=404)
 
     # 1. Wait for background lookup if needed (Max 2.5 seconds)
-    wait_count = 0
-    while not call_state.get("lookup_done") and wait_count < 25:
-        await asyncio.sleep(0.1)
-        call_state = await state.get_call_state(call_uuid)
-        wait_count += 1
+    if not call_state.get("lookup_done"):
+        try:
+            await asyncio.wait_for(state.get_lookup_event(call_uuid).wait(), timeout=2.5)
+        except TimeoutError:
+            pass
+        call_state = state.get_call_state(call_uuid)
     
     if call_state.get("processing"):
-        print(" Processing...")
-        return JSONResponse(content=[])
+        logger.info("Processing...")
+        return []
     
     call_state["processing"] = True
-    await state.set_call_state(call_uuid, call_state)
+    state.set_call_state(call_uuid, call_state)
     
-    turn_start = time.time()
+    turn_start = time.perf_counter()
     
     # 2. Parse Speech - WHISPER (Enabled for testing)
     # asr_marker = "DEEPGRAM"
@@ -445,72 +512,69 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
     
     try:
         # DEBUG: Print exact keys received to diagnose "No Audio" cases
-        print(f" [DEBUG_PAYLOAD] Received Keys: {list(data.keys())}", flush=True)
+        logger.debug("[DEBUG_PAYLOAD] Received Keys: %s", list(data.keys()))
         if 'status' in data:
-            print(f" [DEBUG_PAYLOAD] Status: {data.get('status')} | Reason: {data.get('reason')}", flush=True)
+            logger.debug("[DEBUG_PAYLOAD] Status: %s | Reason: %s", data.get('status'), data.get('reason'))
         if 'speech' in data:
-            print(f" [DEBUG_PAYLOAD] Speech Data: {data.get('speech')}", flush=True)
+            logger.debug("[DEBUG_PAYLOAD] Speech Data: %s", data.get('speech'))
             
         audio_data = data.get("audio")
         # Fallback: Check for recording_url (common in some Vonage configs)
         if not audio_data and data.get("recording_url"):
-            print(f" [VONAGE] Found recording_url. Downloading...", flush=True)
+            logger.info("[VONAGE] Found recording_url. Downloading...")
             audio_data = data.get("recording_url") # transcribe_deep handles URLs
             
         if not audio_data:
-            print(" [ERROR] No audio data or recording_url received from Vonage!", flush=True)
+            logger.error("[ERROR] No audio data or recording_url received from Vonage!")
             speech_text = "[NO_AUDIO]"
         else:
-            st = time.time()
+            st = time.perf_counter()
             # WHISPER ASR (Toggled ON)
             # Make sure transcribe_whisper is imported in the header!
             from .groq import transcribe_whisper
             speech_text = await transcribe_whisper(audio_data)
-            print(f" [LATENCY] ASR Process: {time.time()-st:.2f}s")
+            logger.debug("[LATENCY] ASR Process: %.2fs", time.perf_counter()-st)
             
             if not speech_text:
-                print(" [ERROR] Deepgram returned empty transcription!", flush=True)
+                logger.error("[ERROR] Deepgram returned empty transcription!")
                 asr_marker = "DEEPGRAM_FAILED"
                 speech_text = "[ASR_FAILED]"
                 
     except Exception as e:
-        print(f" [ERROR] Speech transcription failed: {e}", flush=True)
+        logger.error("[ERROR] Speech transcription failed: %s", e)
         asr_marker = "DEEPGRAM_ERROR"
         speech_text = "[ASR_ERROR]"
     
-    print(f" USER ({asr_marker}): '{speech_text}' (Contact: {call_state.get('contact_name', 'Unknown')})", flush=True)
+    logger.info("USER (%s): '%s' (Contact: %s)", asr_marker, speech_text, call_state.get('contact_name', 'Unknown'))
+    
+    # Cleaned once; reused by the noise filter and the KB confidence filter
+    cleaned_speech = _RE_PUNCT.sub('', speech_text.lower().strip())
     
     # ASR Error Handling: Don't filter ASR error tags
-    asr_error_tags = {"[ASR_FAILED]", "[ASR_ERROR]", "[NO_AUDIO]"}
-    if speech_text in asr_error_tags:
-        print(f"  [ASR_ERROR] Deepgram transcription issue: {speech_text}", flush=True)
+    if speech_text in _ASR_ERROR_TAGS:
+        logger.error("[ASR_ERROR] Deepgram transcription issue: %s", speech_text)
         # Keep the error tag so AI can handle it appropriately
     else:
         # Noise Filter: Discard common disturbance/gibberish artifacts
-        noise_artifacts = {"hau", "uh", "um", "the wind", "background noise", "[noise]", "disturbance"}
-        cleaned_speech = re.sub(r'[^\w\s]', '', speech_text.lower().strip())
-        
         is_noise = False
-        # Expand whitelist: Allow common confirmation/greeting words even if short
-        whitelist = {"yes", "no", "ok", "help", "yeah", "yep", "sure", "yup", "hi", "hey"}
-        if speech_text and len(speech_text) < 5 and cleaned_speech not in whitelist:
+        if speech_text and len(speech_text) < 5 and cleaned_speech not in _SHORT_WORD_WHITELIST:
             is_noise = True
-        elif cleaned_speech in noise_artifacts:
+        elif cleaned_speech in _NOISE_ARTIFACTS:
             is_noise = True
             
         if not speech_text or len(speech_text) < 2 or is_noise:
             if is_noise:
-                print(f"  [NOISE] Filtering artifact: '{speech_text}'")
+                logger.info("[NOISE] Filtering artifact: '%s'", speech_text)
             speech_text = "[SILENCE]"
-            print(f"  Silence or noise detected for {call_state.get('contact_name', 'Unknown')}", flush=True)
+            logger.info("Silence or noise detected for %s", call_state.get('contact_name', 'Unknown'))
     
     # 3. Synchronous Pipeline
     try:
-        await state.append_history(call_uuid, "user", speech_text)
+        state.append_history(call_uuid, "user", speech_text)
         
         # ASR ERROR SHORT-CIRCUIT: Don't waste time on KB/LLM if ASR failed
-        if speech_text in asr_error_tags:
-            print(f" [SHORT-CIRCUIT] Skipping KB/LLM due to ASR failure: {speech_text}", flush=True)
+        if speech_text in _ASR_ERROR_TAGS:
+            logger.warning("[SHORT-CIRCUIT] Skipping KB/LLM due to ASR failure: %s", speech_text)
             # Simple fallback response
             ai_response = "I'm sorry, I couldn't hear you clearly due to a connection issue. Could you please repeat that?"
             
@@ -520,24 +584,33 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
                 {"action": "input", "type": ["speech"], "eventUrl": [f"{PUBLIC_URL}/voice/asr"], "speech": {"language": "en-US", "endOnSilence": 1.5}}
             ]
             call_state["processing"] = False
-            await state.set_call_state(call_uuid, call_state)
-            return JSONResponse(content=ncco)
+            state.set_call_state(call_uuid, call_state)
+            return ncco
 
         # Confidence Filter: Skip KB for short/confirmation turns
-        kb = ""
-        st = time.time()
-        confirmations = {"yes", "no", "okay", "ok", "yep", "sure", "correct", "perfect", "done", "completed"}
-        query_clean = re.sub(r'[^\w\s]', '', speech_text.lower().strip())
-        
-        if len(speech_text) < 10 or query_clean in confirmations:
-            print(f" [LATENCY] KB Search SKIPPED for short/confirmation turn: '{speech_text}'")
+        # KB that arrived too late for an earlier turn is used when this turn has none
+        kb = call_state.pop("pending_kb", "")
+        st = time.perf_counter()
+        # (a "[SILENCE]" turn is always under 10 chars, so cleaned_speech still matches speech_text here)
+        if len(speech_text) < 10 or cleaned_speech in _CONFIRMATIONS:
+            logger.debug("[LATENCY] KB Search SKIPPED for short/confirmation turn: '%s'", speech_text)
         else:
-            kb = await fetch_combined_knowledge(speech_text)
-            print(f" [LATENCY] KB Search: {time.time()-st:.2f}s")
+            # Give the KB search a short budget; if it misses, answer now and
+            # keep the results for the next turn instead of stalling this one
+            kb_task = spawn(fetch_combined_knowledge(speech_text))
+            done, _ = await asyncio.wait({kb_task}, timeout=KB_WAIT_BUDGET)
+            if kb_task in done:
+                kb = kb_task.result()
+                logger.debug("[LATENCY] KB Search: %.2fs", time.perf_counter()-st)
+            else:
+                kb_task.add_done_callback(partial(_stash_pending_kb, call_state))
+                logger.debug("[LATENCY] KB Search not ready after %ss, continuing without it", KB_WAIT_BUDGET)
         
         active_id = call_state.get("ticket_id")
         
-        st = time.time()
+        st = time.perf_counter()
+        # The whole reply goes back in this turn's NCCO talk action. Injecting part
+        # of it via PUT /talk would race that talk, since Vonage doesn't sequence them.
         ai_response = await agent_response(
             speech_text, 
             kb, 
@@ -549,103 +622,92 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
             max_tokens=600,
             temperature=0.3
         )
-        print(f" [LATENCY] LLM Turn: {time.time()-st:.2f}s")
+        logger.debug("[LATENCY] LLM Turn: %.2fs", time.perf_counter()-st)
         
         # 3. Update Persistent History (Assistant Turn) - Added missing sync
-        await state.append_history(call_uuid, "assistant", ai_response)
+        state.append_history(call_uuid, "assistant", ai_response)
+
+        # Collect all action tags in a single pass (first usable occurrence of
+        # each action wins), then strip every tag from the spoken text
+        actions = {}
+        for m in _RE_ACTION_TAGS.finditer(ai_response):
+            action = m.group("act") or "SENTIMENT"
+            if action in actions:
+                continue
+            value = (m.group("sent") if action == "SENTIMENT" else m.group("arg") or "").strip()
+            if value or action not in _ACTIONS_NEEDING_ARG:
+                actions[action] = value
+        ai_response = _RE_TAG_SCRUB.sub('', ai_response).strip()
 
         # 3a. Detect Sentiment Action (Added)
-        sentiment_match = re.search(r'\[SENTIMENT:\s*([^\]]+)\]', ai_response)
-        if sentiment_match:
-            sentiment = sentiment_match.group(1).strip().capitalize()
-            print(f" [FALLBACK] Sentiment detected: {sentiment}", flush=True)
+        if actions.get("SENTIMENT"):
+            sentiment = actions["SENTIMENT"].capitalize()
+            logger.info("[FALLBACK] Sentiment detected: %s", sentiment)
             call_state["sentiment"] = sentiment
-            await state.set_call_state(call_uuid, call_state)
-            # Strip sentiment tag
-            ai_response = re.sub(r'\[SENTIMENT:.*?\]', '', ai_response).strip()
 
         # 3b. Detect Ticket Actions
-        create_match = re.search(r'\[ACTION: CREATE_TICKET: (.*?)\]', ai_response)
-        if create_match:
-            issue_summary = create_match.group(1)
-            print(f" [TICKET] AI requested new ticket for: {issue_summary}", flush=True)
+        if "CREATE_TICKET" in actions:
+            issue_summary = actions["CREATE_TICKET"]
+            logger.info("[TICKET] AI requested new ticket for: %s", issue_summary)
             active_id = await create_ticket(call_uuid, issue_summary, call_state.get("phone"), call_state.get("sentiment", "Neutral"), requester_id=call_state.get("contact_id"))
             call_state["ticket_id"] = active_id
-            await state.set_call_state(call_uuid, call_state)
-            ai_response = re.sub(r'\[ACTION: CREATE_TICKET: .*?\]', '', ai_response).strip()
 
         # 3g. Detect Ticket Adoption Action (for matched existing tickets)
-        use_match = re.search(r'\[ACTION: USE_TICKET: (\d+)\]', ai_response)
-        if use_match:
-            adopted_id = use_match.group(1)
-            print(f" [SESSION] Adopting matching ticket: {adopted_id}", flush=True)
+        adopted_id = actions.get("USE_TICKET")
+        if adopted_id and adopted_id.isdigit():
+            logger.info("[SESSION] Adopting matching ticket: %s", adopted_id)
             call_state["ticket_id"] = adopted_id
-            await state.set_call_state(call_uuid, call_state)
-            ai_response = re.sub(r'\[ACTION: USE_TICKET: \d+\]', '', ai_response).strip()
 
         # 3b. Detect Resolution Action
-        resolve_match = re.search(r'\[ACTION: RESOLVE_TICKET: (\d+)\]', ai_response)
-        if resolve_match:
-            target_ticket_id = resolve_match.group(1)
-            print(f" [RESOLVE] AI requested to resolve ticket: {target_ticket_id}", flush=True)
+        target_ticket_id = actions.get("RESOLVE_TICKET")
+        if target_ticket_id and target_ticket_id.isdigit():
+            logger.info("[RESOLVE] AI requested to resolve ticket: %s", target_ticket_id)
             await update_ticket_status(int(target_ticket_id), status=4)
-            ai_response = re.sub(r'\[ACTION: RESOLVE_TICKET: \d+\]', '', ai_response).strip()
 
         # 3c. Detect Contact Name Update Action
-        name_match = re.search(r'\[ACTION: UPDATE_NAME: (.*?)\]', ai_response)
-        if name_match and call_state.get("contact_id"):
-            new_name = name_match.group(1).strip()
+        if "UPDATE_NAME" in actions and call_state.get("contact_id"):
+            new_name = actions["UPDATE_NAME"]
             # Only update if current name is empty, numeric, or "Unknown"
             current_name = call_state.get("contact_name")
-            is_placeholder = not current_name or current_name.lower() == "unknown" or re.match(r'^\+?\d+$', str(current_name).replace(" ", ""))
+            is_placeholder = not current_name or current_name.lower() == "unknown" or str(current_name).replace(" ", "").lstrip("+").isdigit()
             
-            if is_placeholder and new_name.lower() != "unknown" and not re.match(r'^\+?\d+$', new_name.replace(" ", "")):
-                print(f" [CONTACT] Updating contact {call_state.get('contact_id')} name to: {new_name}", flush=True)
+            if is_placeholder and new_name.lower() != "unknown" and not new_name.replace(" ", "").lstrip("+").isdigit():
+                logger.info("[CONTACT] Updating contact %s name to: %s", call_state.get('contact_id'), new_name)
                 await update_contact_name(call_state["contact_id"], new_name)
                 call_state["contact_name"] = new_name
-                await state.set_call_state(call_uuid, call_state)
             else:
-                print(f" [CONTACT] Skipping name update to '{new_name}' because current name '{current_name}' is already valid or new name is placeholder.", flush=True)
-            ai_response = re.sub(r'\[ACTION: UPDATE_NAME: .*?\]', '', ai_response).strip()
+                logger.info("[CONTACT] Skipping name update to '%s' because current name '%s' is already valid or new name is placeholder.", new_name, current_name)
 
         # 3d. Detect Hangup Action
-        should_hangup = "[ACTION: HANGUP]" in ai_response
+        should_hangup = "HANGUP" in actions
         if should_hangup:
-            print(f" [HANGUP] AI requested to end the call", flush=True)
-            ai_response = ai_response.replace("[ACTION: HANGUP]", "").strip()
+            logger.info("[HANGUP] AI requested to end the call")
 
         # 3e. Detect Wait Action
-        should_wait = "[ACTION: WAIT]" in ai_response
+        should_wait = "WAIT" in actions
         if should_wait:
-            print(f" [WAIT] AI requested to wait for the user", flush=True)
-            ai_response = ai_response.replace("[ACTION: WAIT]", "").strip()
+            logger.info("[WAIT] AI requested to wait for the user")
 
         # 3f. Detect Transfer Action
         # Tag format: [ACTION: TRANSFER] or [ACTION: TRANSFER: 1234567890]
-        transfer_match = re.search(r'\[ACTION: TRANSFER(?::\s*(\d+))?\]', ai_response)
-        should_transfer = False
+        should_transfer = "TRANSFER" in actions
         target_number = AGENT_NUMBER
 
         # Check for transfer directive
-        if transfer_match:
-            should_transfer = True
-            raw_number = transfer_match.group(1)
+        if should_transfer:
+            raw_number = actions["TRANSFER"]
             if raw_number:
-                clean_number = "".join(filter(str.isdigit, raw_number))
+                clean_number = _RE_NON_DIGIT.sub('', raw_number)
                 if len(clean_number) >= 7:
                     target_number = clean_number
-                    print(f" [TRANSFER] Transferring to: {target_number} (Specific)", flush=True)
+                    logger.info("[TRANSFER] Transferring to: %s (Specific)", target_number)
                 else:
-                    print(f" [TRANSFER] Invalid number: {raw_number}. Using default: {target_number}", flush=True)
+                    logger.warning("[TRANSFER] Invalid number: %s. Using default: %s", raw_number, target_number)
             else:
-                print(f" [TRANSFER] Transferring to default agent: {target_number}", flush=True)
+                logger.info("[TRANSFER] Transferring to default agent: %s", target_number)
 
             # Mark transfer in state for tracking
             call_state["transfer_requested"] = True
-            await state.set_call_state(call_uuid, call_state)
-
-            # Clean up response
-            ai_response = re.sub(r'\[ACTION: TRANSFER(?::\s*\d+)?\]', '', ai_response).strip()
 
         # Build Response
         ncco = []
@@ -658,7 +720,7 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
             formatted_target = target_number if target_number.startswith("+") else f"+{target_number}"
             formatted_from = call_state.get("bot_number", AGENT_NUMBER)
 
-            print(f" [TRANSFER_EXECUTING] From: {formatted_from} → To: {formatted_target}")
+            logger.info("[TRANSFER_EXECUTING] From: %s → To: %s", formatted_from, formatted_target)
 
             # Add connect action for transfer
             ncco.append({
@@ -673,7 +735,7 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
             })
 
             # Don't continue conversation after transfer
-            print(f" [TRANSFER_COMPLETE] NCCO sent with connect action", flush=True)
+            logger.info("[TRANSFER_COMPLETE] NCCO sent with connect action")
 
         elif should_hangup:
             ncco.append({"action": "hangup"})
@@ -691,22 +753,21 @@ async def handle_voice_asr(state: ConversationState, _a, _b, request: Request):
                 }
             })
 
-        print(f" [LATENCY] Total Turn: {time.time()-turn_start:.2f}s")
-        print(f" [RESPONSE_NCCO] Sending: {ncco}", flush=True)
+        logger.debug("[LATENCY] Total Turn: %.2fs", time.perf_counter()-turn_start)
+        logger.debug("[RESPONSE_NCCO] Sending: %s", ncco)
         call_state["processing"] = False
-        await state.set_call_state(call_uuid, call_state)
-        return JSONResponse(content=ncco)
+        state.set_call_state(call_uuid, call_state)
+        return ncco
 
     except Exception as e:
-        print(f" Pipeline error: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception("Pipeline error: %s", e)
         ai_response = "I encountered an error. Could you repeat that?"
         call_state["processing"] = False
-        await state.set_call_state(call_uuid, call_state)
-        return JSONResponse(content=[
+        state.set_call_state(call_uuid, call_state)
+        return [
             {"action": "talk", "text": ai_response, "bargeIn": True},
             {"action": "input", "type": ["speech"], "eventUrl": [f"{PUBLIC_URL}/voice/asr"], "speech": {"language": "en-US", "endOnSilence": 1.5}}
-        ])
+        ]
 
 async def handle_voice_answer(state: ConversationState, request: Request):
     try:
@@ -722,13 +783,16 @@ async def handle_voice_answer(state: ConversationState, request: Request):
         to_number = data.get("to") or "unknown"
         region_url = data.get("region_url")
         
-        print(f" [TRACE] Extraction: Call ID: {call_uuid}, From: '{from_number}', To: '{to_number}', Region: {region_url}", flush=True)
+        logger.debug("[TRACE] Extraction: Call ID: %s, From: '%s', To: '%s', Region: %s", call_uuid, from_number, to_number, region_url)
+        
+        # Open the Groq connection while the greeting plays
+        spawn(warm_up())
         
         # Generic fallback
         greeting = "Hello. Welcome to Sandeza support. How can I help you today?"
         
-        await state.set_call_state(call_uuid, {
-            "history": [],
+        state.set_call_state(call_uuid, {
+            "history": new_history(),
             "processing": False,
             "ticket_id": None,
             "phone": from_number,
@@ -742,41 +806,50 @@ async def handle_voice_answer(state: ConversationState, request: Request):
         # Start background lookup task
         lookup_task = None
         if from_number != "unknown" and len(from_number) > 5:
-            lookup_task = asyncio.create_task(background_freshdesk_lookup(state, call_uuid, from_number))
+            lookup_task = spawn(background_freshdesk_lookup(state, call_uuid, from_number))
+            # Kept on the call so a hangup can cancel a lookup that is still running
+            state.get_call_state(call_uuid)["lookup_task"] = lookup_task
             
             # HYBRID LOGIC: Wait briefly (0.4s) for a fast lookup for snappiness
             # If lookup is slow, greeting proceeds anonymously and background sync handles the rest
             try:
-                print(f" [HYBRID] Waiting 0.4s for name lookup...", flush=True)
-                done, pending = await asyncio.wait([lookup_task], timeout=0.4)
+                logger.info("[HYBRID] Waiting 0.4s for name lookup...")
+                # Wait on the lookup's completion event, not the task, so hitting
+                # the deadline leaves the lookup running
+                try:
+                    async with asyncio.timeout(0.4):
+                        await state.get_lookup_event(call_uuid).wait()
+                except TimeoutError:
+                    logger.info("[HYBRID] Lookup still running after 0.4s")
                 
                 # Re-fetch state to see if name was set
-                cs = await state.get_call_state(call_uuid)
+                cs = state.get_call_state(call_uuid)
                 if cs:
                     raw_name = cs.get("contact_name", "")
                     # Only greet if name is a real name (not unknown, numeric, or a phone number)
                     # MUST contain at least one letter
-                    is_valid_name = raw_name and re.search(r'[a-zA-Z]', str(raw_name)) and raw_name.lower() != "unknown"
+                    is_valid_name = raw_name and any(c.isalpha() for c in str(raw_name)) and raw_name.lower() != "unknown"
                     
                     if is_valid_name:
                         greeting = f"Hello {raw_name}. Welcome back to Sandeza support. How can I help you today?"
-                        print(f" [HYBRID] Personalization success: {raw_name}", flush=True)
+                        logger.info("[HYBRID] Personalization success: %s", raw_name)
                     else:
-                        print(f" [HYBRID] Name is numeric or placeholder ({raw_name}). Skipping personalization.", flush=True)
+                        logger.info("[HYBRID] Name is numeric or placeholder (%s). Skipping personalization.", raw_name)
                 else:
-                    print(f" [HYBRID] Timeout or no name found. Using generic.", flush=True)
+                    logger.info("[HYBRID] Timeout or no name found. Using generic.")
             except Exception as e:
-                print(f" [HYBRID] Wait error: {e}", flush=True)
+                logger.error("[HYBRID] Wait error: %s", e)
         else:
             # Mark as done if no phone
-            cs = await state.get_call_state(call_uuid)
+            cs = state.get_call_state(call_uuid)
             cs["lookup_done"] = True
-            await state.set_call_state(call_uuid, cs)
+            state.set_call_state(call_uuid, cs)
+            state.get_lookup_event(call_uuid).set()
 
-        await state.append_history(call_uuid, "assistant", greeting)
+        state.append_history(call_uuid, "assistant", greeting)
         
         ws_url = PUBLIC_URL.replace("http", "ws") + "/voice/stream"
-        print(f" [STREAM] Generating NCCO with Websocket URL: {ws_url}", flush=True)
+        logger.info("[STREAM] Generating NCCO with Websocket URL: %s", ws_url)
         
         ncco = [
             {"action": "talk", "text": greeting, "bargeIn": False},
@@ -792,12 +865,11 @@ async def handle_voice_answer(state: ConversationState, request: Request):
                 }]
             }
         ]
-        print(f" [STREAM] NCCO: {ncco}", flush=True)
-        return JSONResponse(content=ncco)
+        logger.debug("[STREAM] NCCO: %s", ncco)
+        return ncco
     except Exception as e:
-        print(f" [ERROR] handle_voice_answer failed: {e}", flush=True)
-        traceback.print_exc()
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        logger.exception("[ERROR] handle_voice_answer failed: %s", e)
+        return ORJSONResponse(content={"error": str(e)}, status_code=500)
 
 async def handle_voice_events(state: ConversationState, request: Request):
     try:
@@ -805,29 +877,39 @@ async def handle_voice_events(state: ConversationState, request: Request):
         status = data.get('status', data.get('type', 'unknown'))
         call_uuid = data.get("uuid") or data.get("conversation_uuid")
         
-        print(f" EVENT: {status}")
+        logger.info("EVENT: %s", status)
         if status == "unknown" or "connection" in status:
-            print(f" [DEBUG_EVENT] Full Payload: {data}", flush=True)
+            logger.debug("[DEBUG_EVENT] Full Payload: %s", data)
         
         if status == "completed" and call_uuid:
-            call_state = await state.get_call_state(call_uuid)
+            call_state = state.get_call_state(call_uuid)
             if call_state:
                 call_state["status"] = "completed"
-                await state.set_call_state(call_uuid, call_state)
+                state.set_call_state(call_uuid, call_state)
+                # Nobody is left to use the lookup result; cancel it before the
+                # event is dropped so it can't re-create one on its way out
+                lookup_task = call_state.pop("lookup_task", None)
+                if lookup_task is not None and not lookup_task.done():
+                    lookup_task.cancel()
+                    try:
+                        await lookup_task
+                    except asyncio.CancelledError:
+                        pass
+                state.drop_lookup_event(call_uuid)
                 
                 if call_state.get("ticket_id"):
                     ticket_id = call_state.get("ticket_id")
                     history = call_state.get("history", [])
                     
-                    print(f" [EVENT] Call {call_uuid} completed. Syncing history to ticket {ticket_id}...")
+                    logger.info("[EVENT] Call %s completed. Syncing history to ticket %s...", call_uuid, ticket_id)
                     # Run sync in background or wait briefly
-                    asyncio.create_task(add_ticket_note(str(ticket_id), history))
+                    spawn(add_ticket_note(str(ticket_id), history))
                 else:
-                    print(f" [EVENT] Call {call_uuid} completed but no ticket_id found in state.")
+                    logger.info("[EVENT] Call %s completed but no ticket_id found in state.", call_uuid)
             else:
-                print(f" [EVENT] Call {call_uuid} completed but no state found.")
+                logger.info("[EVENT] Call %s completed but no state found.", call_uuid)
                 
     except Exception as e:
-        print(f" [EVENT] Error processing event: {e}")
+        logger.error("[EVENT] Error processing event: %s", e)
     
-    return JSONResponse(content=[])
+    return []
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+from app.main import _split_tags
+
+# The regexes _split_tags replaced; its output must match them exactly
+_TAG_RE = re.compile(r'\[(ACTION|SENTIMENT):\s*([^\]]+)\]')
+_STRIP_RE = re.compile(r'\[(ACTION|SENTIMENT):[^\]]+\]')
+
+CASES = [
+    "",
+    "   ",
+    "Hello there.",
+    "Sure thing. [ACTION: CREATE_TICKET]",
+    "[SENTIMENT: Positive] Glad to help!",
+    "Done [ACTION: HANGUP] bye [SENTIMENT:Neutral]",
+    "[ACTION:UPDATE_NAME: Bob] Thanks Bob.",
+    "Spaces only [ACTION:   ] here",
+    "Empty [ACTION:] tag",
+    "Empty then close [ACTION:] x] end",
+    "Unclosed [ACTION: HANGUP",
+    "Nested [ACTION: a [ACTION: b] c]",
+    "Other [NOTE: keep] brackets [x]",
+    "Lowercase [action: nope] stays",
+    "[[ACTION: X]]",
+    "Two [ACTION: A][ACTION: B] adjacent",
+    "Newline [ACTION:\nTRANSFER] inside",
+]
+
+
+@pytest.mark.parametrize("text", CASES)
+def test_matches_regex(text):
+    tags, clean = _split_tags(text)
+    assert tags == _TAG_RE.findall(text)
+    assert clean == _STRIP_RE.sub('', text).strip()
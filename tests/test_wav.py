@@ -0,0 +1,33 @@
+import io
+import wave
+
+import pytest
+
+from app.groq import MAX_AUDIO_PCM_BYTES, pcm16_to_wav_bytes
+
+
+def _reference_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(pcm)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 2, 640, 32000])
+def test_matches_stdlib_wave(size):
+    pcm = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    assert pcm16_to_wav_bytes(pcm) == _reference_wav(pcm)
+
+
+def test_header_fields():
+    wav = pcm16_to_wav_bytes(b"\x01\x00" * 160)
+    with wave.open(io.BytesIO(wav)) as w:
+        assert (w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes()) == (1, 2, 16000, 160)
+
+
+def test_rejects_oversized_payload():
+    with pytest.raises(ValueError):
+        pcm16_to_wav_bytes(bytes(MAX_AUDIO_PCM_BYTES + 2))